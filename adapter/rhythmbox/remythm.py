@@ -23,6 +23,7 @@
 """Rhythmbox player adapter for Remuco, implemented as a Rhythmbox plugin."""
 
 import time
+import urllib
 
 import gconf
 import gobject
@@ -98,6 +99,8 @@ SEARCH_PROPS_ANY = (rhythmdb.PROP_ARTIST, rhythmdb.PROP_TITLE,
                     rhythmdb.PROP_ALBUM, rhythmdb.PROP_GENRE,
                     rhythmdb.PROP_LOCATION)
 
+SEARCH_INDEX_CHUNK = 500 # number of entries to index per idle callback
+
 # =============================================================================
 # actions
 # =============================================================================
@@ -113,6 +116,254 @@ MLIB_LIST_ACTIONS = (LA_PLAY,)
 MLIB_ITEM_ACTIONS = (IA_ENQUEUE, IA_JUMP)
 SEARCH_ACTIONS = (IA_ENQUEUE,)
 
+# =============================================================================
+# search index
+# =============================================================================
+
+class SearchIndex(object):
+    """Index for substring searches on entry properties.
+    
+    For each property, the index maps all 3-character substrings (trigrams)
+    of property values to the IDs of the entries containing them. A search
+    intersects the ID sets of the query's trigrams and then checks the few
+    remaining candidates. Queries shorter than 3 characters get checked
+    against all indexed values (still without touching the RhythmDB).
+    
+    Property values are expected to be lower case already.
+    
+    """
+    
+    GRAM_LEN = 3
+    
+    def __init__(self, props):
+        """Create a new search index.
+        
+        @param props: searchable properties
+        
+        """
+        self.__props = props
+        self.__entries = {} # ID -> (sequence number, name, values)
+        self.__grams = {} # (prop, gram) -> set of IDs
+        self.__seq = 0
+        
+    def __len__(self):
+        return len(self.__entries)
+    
+    def add(self, id, name, values):
+        """Add or update an entry.
+        
+        @param id: the entry's ID
+        @param name: the entry's name (as used in item lists)
+        @param values: dictionary of property values
+        
+        """
+        self.remove(id)
+        
+        self.__seq += 1
+        self.__entries[id] = (self.__seq, name, values)
+        
+        for prop in self.__props:
+            for gram in self.__get_grams(values[prop]):
+                try:
+                    self.__grams[(prop, gram)].add(id)
+                except KeyError:
+                    self.__grams[(prop, gram)] = set((id,))
+                    
+    def remove(self, id):
+        """Remove an entry (if present)."""
+        
+        try:
+            seq, name, values = self.__entries.pop(id)
+        except KeyError:
+            return
+        
+        for prop in self.__props:
+            for gram in self.__get_grams(values[prop]):
+                key = (prop, gram)
+                ids = self.__grams.get(key)
+                if ids is None:
+                    continue
+                ids.discard(id)
+                if not ids:
+                    del self.__grams[key]
+    
+    def search(self, query):
+        """Search entries.
+        
+        @param query: dictionary mapping properties to lower case search
+            strings - an entry matches if for every query property one of the
+            related entry properties contains the search string (the key
+            'Any' relates to all indexed properties)
+        
+        @return: 2 lists - IDs and names of the matching entries, in the order
+            they have been added to the index
+            
+        """
+        candidates = None
+        
+        for key, val in query.items():
+            if key == "Any":
+                props = self.__props
+            else:
+                props = (key,)
+            matches = set()
+            for prop in props:
+                matches |= self.__lookup(prop, val, candidates)
+            candidates = matches
+            if not candidates:
+                break
+        
+        results = [self.__entries[id] + (id,) for id in candidates or ()]
+        results.sort()
+        
+        ids = [result[3] for result in results]
+        names = [result[1] for result in results]
+        
+        return ids, names
+        
+    def __lookup(self, prop, val, candidates):
+        """Get IDs of entries whose value of 'prop' contains 'val'."""
+        
+        grams = self.__get_grams(val)
+        
+        if candidates is not None:
+            ids = candidates
+        elif not grams:
+            ids = self.__entries
+        else:
+            sets = [self.__grams.get((prop, gram), ()) for gram in grams]
+            sets.sort(key=len)
+            ids = set(sets[0])
+            for other in sets[1:]:
+                if not ids:
+                    break
+                ids &= other
+        
+        entries = self.__entries
+        
+        return set([id for id in ids if val in entries[id][2][prop]])
+    
+    def __get_grams(self, val):
+        
+        n = SearchIndex.GRAM_LEN
+        
+        return set([val[i:i + n] for i in range(len(val) - n + 1)])
+    
+# =============================================================================
+# position index
+# =============================================================================
+
+class PositionIndex(object):
+    """Maps item IDs (locations) to positions in a query model.
+    
+    The IDs of the model's rows are kept in a list which gets updated on row
+    insertions, deletions and changes. A dictionary of ID positions is
+    derived from that list when needed. Appending or removing the last row
+    keeps the dictionary valid, other changes require to derive it again
+    (without touching the RhythmDB).
+    
+    """
+    
+    def __init__(self, db, qmodel):
+        
+        self.qmodel = qmodel
+        
+        self.__db = db
+        self.__ids = None # IDs in model order, None if unknown
+        self.__positions = None # ID -> first position, None if unknown
+        
+        self.__signal_ids = (
+            qmodel.connect("row-inserted", self.__notify_row_inserted),
+            qmodel.connect("row-deleted", self.__notify_row_deleted),
+            qmodel.connect("row-changed", self.__notify_row_changed),
+            qmodel.connect("rows-reordered", self.__notify_rows_reordered)
+        )
+        
+    def release(self):
+        """Disconnect from the query model."""
+        
+        for sid in self.__signal_ids:
+            self.qmodel.disconnect(sid)
+            
+        self.__signal_ids = ()
+    
+    def get_position(self, id):
+        """Get the position of an item.
+        
+        @return: the position of the first row with the given ID or, if
+            there is no such row, the number of rows in the model
+        
+        """
+        if self.__ids is None:
+            self.__ids = [self.__db.entry_get(row[0], rhythmdb.PROP_LOCATION)
+                          for row in self.qmodel]
+            self.__positions = None
+        
+        if self.__positions is None:
+            self.__positions = {}
+            for i, id_i in enumerate(self.__ids):
+                self.__positions.setdefault(id_i, i)
+        
+        return self.__positions.get(id, len(self.__ids))
+    
+    def __notify_row_inserted(self, qmodel, path, iter):
+        
+        if self.__ids is None:
+            return
+        
+        position = path[0]
+        entry = qmodel.get_value(iter, 0)
+        id = self.__db.entry_get(entry, rhythmdb.PROP_LOCATION)
+        
+        self.__ids.insert(position, id)
+        
+        if self.__positions is None:
+            return
+        
+        if position == len(self.__ids) - 1:
+            self.__positions.setdefault(id, position)
+        else:
+            self.__positions = None
+        
+    def __notify_row_deleted(self, qmodel, path):
+        
+        if self.__ids is None:
+            return
+        
+        position = path[0]
+        id = self.__ids.pop(position)
+        
+        if self.__positions is None:
+            return
+        
+        if position == len(self.__ids):
+            if self.__positions.get(id) == position:
+                del self.__positions[id]
+        else:
+            self.__positions = None
+        
+    def __notify_row_changed(self, qmodel, path, iter):
+        
+        # emitted on any entry change, e.g. on play count updates
+        
+        if self.__ids is None:
+            return
+        
+        position = path[0]
+        entry = qmodel.get_value(iter, 0)
+        id = self.__db.entry_get(entry, rhythmdb.PROP_LOCATION)
+        
+        if self.__ids[position] == id:
+            return
+        
+        self.__ids[position] = id
+        self.__positions = None
+        
+    def __notify_rows_reordered(self, qmodel, path, iter, *args):
+        
+        self.__ids = None
+        self.__positions = None
+
 # =============================================================================
 # player adapter
 # =============================================================================
@@ -139,6 +390,14 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
         self.__queue_sc = None
         
         self.__signal_ids = ()
+        self.__db_signal_ids = ()
+        
+        self.__search_index = None
+        self.__search_index_sid = None
+        self.__search_index_deleted = set()
+        
+        self.__playlist_index = None
+        self.__queue_index = None
         
         log.debug("init done")
 
@@ -172,6 +431,25 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
             sp.connect("playing-source-changed", self.__notify_source_changed)
         )
 
+        # build search index in background, keep it up to date by db signals
+        
+        db = self.__shell.props.db
+        
+        self.__db_signal_ids = (
+            db.connect("entry-added", self.__notify_entry_added),
+            db.connect("entry-changed", self.__notify_entry_changed),
+            db.connect("entry-deleted", self.__notify_entry_deleted)
+        )
+        
+        entries = []
+        db.entry_foreach(entries.append)
+        entries.reverse() # to pop() in db order
+        
+        self.__search_index = SearchIndex(SEARCH_PROPS_ANY)
+        self.__search_index_deleted.clear()
+        self.__search_index_sid = gobject.idle_add(self.__build_search_index,
+                                                   entries)
+        
         # state sync will happen by timeout
         # trigger item sync:
         self.__notify_playing_uri_changed(sp, sp.get_playing_path()) # item sync
@@ -193,6 +471,31 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
             sp.disconnect(sid)
             
         self.__signal_ids = ()
+        
+        db = self.__shell.props.db
+        
+        for sid in self.__db_signal_ids:
+            db.disconnect(sid)
+        
+        self.__db_signal_ids = ()
+        
+        # release search index
+        
+        if self.__search_index_sid is not None:
+            gobject.source_remove(self.__search_index_sid)
+            self.__search_index_sid = None
+        
+        self.__search_index = None
+        self.__search_index_deleted.clear()
+        
+        # release position indices
+        
+        for pi in (self.__playlist_index, self.__queue_index):
+            if pi is not None:
+                pi.release()
+        
+        self.__playlist_index = None
+        self.__queue_index = None
 
         # release shell
         
@@ -499,34 +802,19 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
         
     def request_search(self, reply, query):
         
-        def eval_entry(entry):
-            match = True
-            for key in query_stripped:
-                if key == "Any":
-                    props = SEARCH_PROPS_ANY
-                else:
-                    props = [key]
-                for prop in props:
-                    val = db.entry_get(entry, prop).lower()
-                    if val.find(query_stripped[key]) >= 0:
-                        break
-                else:
-                    match = False
-                    break
-            if match:
-                id, name = self.__get_list_item_from_entry(entry)
-                reply.ids.append(id)
-                reply.names.append(name)
-        
         query_stripped = {} # stripped query dict
         
         for key, val in zip(SEARCH_PROPS, query):
             if val.strip():
                 query_stripped[key] = val.lower()
 
-        if query_stripped:
-            db = self.__shell.props.db
-            db.entry_foreach(eval_entry)
+        if not query_stripped:
+            pass
+        elif self.__search_index_sid is None:
+            reply.ids, reply.names = self.__search_index.search(query_stripped)
+        else:
+            log.debug("search index not yet ready, scan db")
+            reply.ids, reply.names = self.__search_db(query_stripped)
         
         reply.item_actions = SEARCH_ACTIONS
         
@@ -588,6 +876,31 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
         else:
             self.update_playback(remuco.PLAYBACK_PAUSE)
 
+    def __notify_entry_added(self, db, entry):
+        """DB signal callback to index a new entry."""
+        
+        self.__index_entry(entry)
+        
+    def __notify_entry_changed(self, db, entry, changes):
+        """DB signal callback to update the index entry of a changed entry."""
+        
+        for change in changes:
+            # a changed location means a changed ID
+            if getattr(change, "prop", None) == rhythmdb.PROP_LOCATION:
+                self.__search_index.remove(change.old)
+        
+        self.__index_entry(entry)
+        
+    def __notify_entry_deleted(self, db, entry):
+        """DB signal callback to remove a deleted entry from the index."""
+        
+        id = db.entry_get(entry, rhythmdb.PROP_LOCATION)
+        
+        self.__search_index.remove(id)
+        
+        if self.__search_index_sid is not None:
+            self.__search_index_deleted.add(id)
+    
     def __notify_source_changed(self, sp, source_new):
         """Shell player signal callback to handle a playlist switch."""
         
@@ -599,6 +912,84 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
     # helper methods
     # =========================================================================
 
+    def __build_search_index(self, entries):
+        """Idle callback to index the next chunk of entries."""
+        
+        db = self.__shell.props.db
+        
+        for i in range(min(SEARCH_INDEX_CHUNK, len(entries))):
+            entry = entries.pop()
+            id = db.entry_get(entry, rhythmdb.PROP_LOCATION)
+            if id not in self.__search_index_deleted:
+                self.__index_entry(entry)
+        
+        if entries:
+            return True
+        
+        log.debug("search index ready (%d entries)" % len(self.__search_index))
+        
+        self.__search_index_sid = None
+        self.__search_index_deleted.clear()
+        
+        return False
+    
+    def __index_entry(self, entry):
+        
+        id, name = self.__get_list_item_from_entry(entry)
+        
+        values = {}
+        for prop in SEARCH_PROPS_ANY:
+            values[prop] = self.__get_search_value(entry, prop)
+        
+        self.__search_index.add(id, name, values)
+        
+    def __get_search_value(self, entry, prop):
+        """Get the lower case value of an entry property to search in.
+        
+        Of locations only the file name is searchable - complete locations
+        are long and would bloat the search index, and folder names usually
+        are covered by artist and album anyway.
+        
+        """
+        val = self.__shell.props.db.entry_get(entry, prop) or ""
+        
+        if prop == rhythmdb.PROP_LOCATION:
+            val = urllib.unquote(val.rsplit("/", 1)[-1])
+        
+        return val.lower()
+        
+    def __search_db(self, query):
+        """Search by scanning the whole DB (used until search index is ready).
+        
+        @param query: dictionary mapping properties to lower case search
+            strings (see SearchIndex.search())
+            
+        @return: 2 lists - IDs and names of the matching entries
+        
+        """
+        ids, names = [], []
+        
+        def eval_entry(entry):
+            for key in query:
+                if key == "Any":
+                    props = SEARCH_PROPS_ANY
+                else:
+                    props = [key]
+                for prop in props:
+                    val = self.__get_search_value(entry, prop)
+                    if val.find(query[key]) >= 0:
+                        break
+                else:
+                    return
+            id, name = self.__get_list_item_from_entry(entry)
+            ids.append(id)
+            names.append(name)
+        
+        db = self.__shell.props.db
+        db.entry_foreach(eval_entry)
+        
+        return ids, names
+        
     def __jump_in_plq(self, sc, position):
         """Do a jump within the playlist or queue.
         
@@ -621,18 +1012,16 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
         if sp.props.playing_from_queue:
             id_to_remove_from_queue = self.__item_id
 
-        found = False
-        i = 0
-        for row in qm:
-            if i == position:
-                sp.set_selected_source(sc)
-                sp.set_playing_source(sc)
-                sp.play_entry(row[0])
-                found = True
-                break
-            i += 1
-        
-        if not found:
+        try:
+            entry = qm[position][0]
+        except (IndexError, ValueError): # no such row
+            entry = None
+        
+        if entry is not None:
+            sp.set_selected_source(sc)
+            sp.set_playing_source(sc)
+            sp.play_entry(entry)
+        else:
             sp.do_next()
         
         if id_to_remove_from_queue != None:
@@ -736,8 +1125,6 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
 
         sp = self.__shell.get_player()
 
-        db = self.__shell.props.db
-
         position = 0
         
         id_now = self.__item_id
@@ -746,19 +1133,41 @@ class RhythmboxAdapter(remuco.PlayerAdapter):
             
             if sp.props.playing_from_queue:
                 qmodel = self.__queue_sc.props.query_model
+                self.__queue_index = self.__get_position_index(
+                                            self.__queue_index, qmodel)
+                pi = self.__queue_index
             elif self.__playlist_sc is not None:
                 qmodel = self.__playlist_sc.get_entry_view().props.model
+                self.__playlist_index = self.__get_position_index(
+                                            self.__playlist_index, qmodel)
+                pi = self.__playlist_index
             else:
-                qmodel = None
+                pi = None
                 
-            if qmodel is not None:
-                for row in qmodel:
-                    id = db.entry_get(row[0], rhythmdb.PROP_LOCATION)
-                    if id_now == id:
-                        break
-                    position += 1
+            if pi is not None:
+                position = pi.get_position(id_now)
                     
         log.debug("position: %i" % position)
         
         return position
-
+    
+    def __get_position_index(self, pi, qmodel):
+        """Get a position index for a query model.
+        
+        @param pi: the current position index of the related source (may be
+            None) - gets released if it does not relate to 'qmodel'
+        @param qmodel: the query model (may be None)
+        
+        @return: a position index for 'qmodel' (None if 'qmodel' is None)
+        
+        """
+        if pi is not None and pi.qmodel is qmodel:
+            return pi
+        
+        if pi is not None:
+            pi.release()
+        
+        if qmodel is None:
+            return None
+        
+        return PositionIndex(self.__shell.props.db, qmodel)
@@ -41,6 +41,10 @@ Class ListReply:
 Class Manager:
     Helper class for managing the life cycle of a player adapter.
 
+Class Worker:
+    Helper class for running slow jobs (e.g. list requests) outside the main
+    loop.
+
 Constants:
     The constants starting with 'INFO' are keys to be used for the dictionary
     describing an item (a playable object: song, video, slide, picture, ...).
@@ -72,6 +76,7 @@ Logging:
 #==============================================================================
 
 from remuco.adapter import PlayerAdapter, ItemAction, ListAction, ListReply
+from remuco.adapter import Worker
 from remuco.config import Config
 from remuco.defs import *
 from remuco.manager import Manager
@@ -81,7 +86,7 @@ from remuco.manager import Manager
 #==============================================================================
 
 __all__ = ("PlayerAdapter", "ListReply",
-           "ItemAction", "ListAction", "Manager", "Config",
+           "ItemAction", "ListAction", "Manager", "Config", "Worker",
            
            "INFO_ALBUM", "INFO_ARTIST", "INFO_GENRE", "INFO_LENGTH",
            "INFO_RATING", "INFO_TAGS", "INFO_TITLE", "INFO_YEAR",
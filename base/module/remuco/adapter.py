@@ -24,7 +24,10 @@ import inspect
 import math # for ceiling
 import os
 import os.path
+import Queue
 import subprocess
+import threading
+import time
 import urllib
 import urlparse
 
@@ -37,6 +40,7 @@ from remuco import log
 from remuco import message
 from remuco import net
 from remuco import serial
+from remuco import thumbs
 
 from remuco.defs import *
 from remuco.features import *
@@ -61,8 +65,12 @@ class ListReply(object):
     reply data (using properties 'ids', 'names', 'item_actions' and
     'nested', 'list_actions') and to send the reply to clients (using send()).
     
+    Instead of setting 'ids' and 'names', player adapters may also provide
+    items on demand, page by page (see set_provider()).
+    
     """
-    def __init__(self, client, request_id, reply_msg_id, page, path=None):
+    def __init__(self, client, request_id, reply_msg_id, page, path=None,
+                 snapshots=None):
         """Create a new list reply.
         
         Used internally, not needed within player adapters.
@@ -73,6 +81,8 @@ class ListReply(object):
         @param page: page of the requested list
         
         @keyword path: path of the requested list, if there is one
+        @keyword snapshots: a _ListSnapshots to store the complete list in
+            when the reply gets sent
         
         """
         self.__client = client
@@ -80,20 +90,60 @@ class ListReply(object):
         self.__reply_msg_id = reply_msg_id
         self.__page = page
         self.__path = path
+        self.__snapshots = snapshots
         
+        self.__provider = None
         self.__nested = []
         self.__ids = []
         self.__names = []
         self.__list_actions = []
         self.__item_actions = []
         
+    def set_provider(self, length, fetch, deferred=False):
+        """Provide items on demand instead of setting 'ids' and 'names'.
+        
+        Player adapters may use this for long lists which are expensive to
+        get completely (e.g. a large playlist), but where the player allows
+        to get a specific range of items. When the reply gets sent, only the
+        items of the page requested by the client get fetched.
+        
+        @param length:
+            number of items in the list
+        @param fetch:
+            a function fetch(start, count) which returns the items in the
+            given range as a list (or generator) of (id, name) pairs
+        @keyword deferred:
+            if True, fetch gets called as fetch(start, count, done) and is
+            supposed to return immediately - once the items are available,
+            call done() with the list of (id, name) pairs (useful when the
+            player provides item information asynchronously)
+        
+        @note: Lists replied using a provider are not kept as snapshots, i.e.
+            each page request results in a call to 'fetch'.
+        
+        """
+        self.__provider = (length, fetch, deferred)
+        
     def send(self):
         """Send the requested item list to the requesting client."""
         
+        if self.__provider is not None:
+            num_items = self.__provider[0]
+        else:
+            num_items = len(self.__ids or [])
+        
+        ### snapshot ###
+        
+        if self.__snapshots is not None and self.__provider is None:
+            self.__snapshots.put(self.__client, self.__reply_msg_id,
+                                 self.__path,
+                                 (self.__nested, self.__ids, self.__names,
+                                  self.__item_actions, self.__list_actions))
+        
         ### paging ###
         
         page_size = self.__client.info.page_size
-        len_all = len(self.__ids or []) + len(self.__nested or [])
+        len_all = num_items + len(self.__nested or [])
         # P3K: remove float() and int()
         page_max = int(max(math.ceil(float(len_all) / page_size) - 1, 0))
         
@@ -103,27 +153,50 @@ class ListReply(object):
         index_start = self.__page * page_size
         index_end = index_start + page_size
         
-        nested, ids, names = [], [], []
-        item_offset = 0
+        nested = []
+        item_start, item_end = 0, 0
         
         if self.__nested and index_start < len(self.__nested):
             # page contains nested lists and maybe items
             nested = self.__nested[index_start:index_end]
             if len(nested) < page_size:
                 # page contains nested lists and items
-                num_items = page_size - len(nested)
-                ids = self.__ids[0:num_items]
-                names = self.__names[0:num_items]
+                item_end = page_size - len(nested)
         else:
             # page contains only items
-            index_start -= len(self.__nested)
-            index_end -= len(self.__nested)
-            ids = self.__ids[index_start:index_end]
-            names = self.__names[index_start:index_end]
-            item_offset = index_start
+            item_start = index_start - len(self.__nested or [])
+            item_end = index_end - len(self.__nested or [])
         
+        item_end = min(item_end, num_items)
         
-        ### sending ###
+        ### fetching ###
+        
+        if self.__provider is None:
+            
+            ids = self.__ids[item_start:item_end]
+            names = self.__names[item_start:item_end]
+            self.__send_page(nested, ids, names, item_start, page_max)
+            
+            return
+        
+        length, fetch, deferred = self.__provider
+        count = max(item_end - item_start, 0)
+        
+        def done(items):
+            ids, names = [], []
+            for id, name in items or ():
+                ids.append(id)
+                names.append(name)
+            self.__send_page(nested, ids, names, item_start, page_max)
+        
+        if count == 0:
+            done(())
+        elif deferred:
+            fetch(item_start, count, done)
+        else:
+            done(fetch(item_start, count))
+            
+    def __send_page(self, nested, ids, names, item_offset, page_max):
         
         ilist = ItemList(self.__request_id,
                          self.__path, nested, ids, names, item_offset,
@@ -134,7 +207,6 @@ class ListReply(object):
         
         gobject.idle_add(self.__client.send, msg)
         
-
     # === property: ids ===
     
     def __pget_ids(self):
@@ -216,6 +288,84 @@ class ListReply(object):
                             __pget_list_actions.__doc__)
 
 
+class _ListSnapshots(object):
+    """Cache of complete lists replied to clients.
+    
+    Clients request lists page by page. To not query the player for the
+    complete list again and again while a client flips through the pages of
+    a list, the complete list gets saved as a snapshot when the first page
+    is sent. Requests for following pages then get replied from that snapshot.
+    
+    Snapshots are identified by client, request message ID and list path.
+    They get dropped when the player adapter signals a change of its lists
+    (see PlayerAdapter.invalidate_lists()), when a client requests the first
+    page of a list again and, as a fallback for missed changes, when they are
+    older than 'ttl' seconds.
+    
+    """
+    def __init__(self, max_lists=10, ttl=30):
+        """Create a new snapshot cache.
+        
+        @keyword max_lists: maximum number of lists to keep
+        @keyword ttl: maximum age of a snapshot in seconds
+        """
+        
+        self.__max_lists = max_lists
+        self.__ttl = ttl
+        self.__snapshots = {} # key -> (time, snapshot)
+        self.__keys = [] # oldest first
+        
+    def get(self, client, msg_id, path):
+        """Get a snapshot (or None if there is no up-to-date snapshot)."""
+        
+        key = (client, msg_id, tuple(path or ()))
+        
+        try:
+            stamp, snapshot = self.__snapshots[key]
+        except KeyError:
+            return None
+        
+        if time.time() - stamp > self.__ttl:
+            self.__keys.remove(key)
+            del self.__snapshots[key]
+            return None
+        
+        return snapshot
+        
+    def put(self, client, msg_id, path, snapshot):
+        """Save a snapshot.
+        
+        @param snapshot: a tuple (nested, ids, names, item actions,
+            list actions)
+        """
+        
+        key = (client, msg_id, tuple(path or ()))
+        
+        if key in self.__snapshots:
+            self.__keys.remove(key)
+        
+        self.__snapshots[key] = (time.time(), snapshot)
+        self.__keys.append(key)
+        
+        if len(self.__keys) > self.__max_lists:
+            del self.__snapshots[self.__keys.pop(0)]
+        
+    def invalidate(self, msg_ids=None):
+        """Drop snapshots.
+        
+        @keyword msg_ids: drop snapshots of these requests (all if None)
+        """
+        
+        if msg_ids is None:
+            self.__snapshots.clear()
+            self.__keys = []
+            return
+        
+        for key in self.__keys[:]:
+            if key[1] in msg_ids:
+                self.__keys.remove(key)
+                del self.__snapshots[key]
+
 # =============================================================================
 # media browser actions
 # =============================================================================
@@ -313,6 +463,85 @@ class ItemAction(object):
     
     id = property(__pget_id, None, None, __pget_id.__doc__)
     
+# =============================================================================
+# worker
+# =============================================================================
+
+ART_WORKERS = 2 # threads for looking up and scaling art images
+ART_PREVIEW_SIZE = 32 # size of art previews (if enabled in config)
+
+class Worker(threading.Thread):
+    """Runs jobs outside the main loop.
+    
+    Jobs which may take a while (e.g. finding and scaling art images or
+    listing a big media library) would otherwise block the main loop and
+    therewith all client communication. Results get passed back to the main
+    loop by gobject.idle_add().
+    
+    Subclasses may override run_job() and finish() to give jobs access to
+    thread specific resources (e.g. a connection to a player).
+    
+    """
+    def __init__(self, jobs, name="worker", current=None):
+        """Create a new worker.
+        
+        @param jobs: a queue of jobs, where a job is a tuple of a function, its
+            arguments, a callback and a key - the callback gets called (within
+            the main loop) with the function's result or None if the function
+            failed, the key may be None (see 'current'), a None job stops the
+            worker
+        @keyword name: thread name
+        @keyword current: a function returning the current key - jobs with
+            another key (which is not None) are outdated and get dropped
+            without running them
+        
+        """
+        threading.Thread.__init__(self, name=name)
+        self.setDaemon(True)
+        
+        self.__jobs = jobs
+        self.__current = current
+        
+    def run(self):
+        
+        while True:
+            
+            job = self.__jobs.get()
+            if job is None: # stop
+                break
+            
+            func, args, callback, key = job
+            
+            if key is not None and key != self.__current():
+                continue # e.g. art of an item which is not current anymore
+            
+            try:
+                result = self.run_job(func, args)
+            except Exception, e:
+                log.exception("** BUG ** %s" % e)
+                result = None
+            
+            gobject.idle_add(callback, result)
+            
+        self.finish()
+        
+    def run_job(self, func, args):
+        """Run a job function and return its result.
+        
+        Subclasses may override this to pass additional arguments or to
+        handle expected errors.
+        
+        """
+        return func(*args)
+    
+    def finish(self):
+        """Called when the worker stops.
+        
+        Subclasses may override this to release resources.
+        
+        """
+        pass
+
 # =============================================================================
 # player adapter
 # =============================================================================
@@ -399,6 +628,14 @@ class PlayerAdapter(object):
         Subclasses of PlayerAdapter may override the method poll() to
         periodically check a player's state.
         
+        * invalidate_lists()
+        
+        If enabled (see keyword 'list_snapshots' in __init__()), lists
+        replied by the request methods above are kept as snapshots to serve
+        requests for further pages of a list. This method then must be
+        called when the content of the playlist, the play queue or the media
+        library has changed.
+        
     ===========================================================================
     Finally some utility methods:
     ===========================================================================
@@ -414,7 +651,7 @@ class PlayerAdapter(object):
     def __init__(self, name, playback_known=False, volume_known=False,
                  repeat_known=False, shuffle_known=False, progress_known=False,
                  max_rating=0, poll=2.5, file_actions=None, mime_types=None,
-                 search_mask=None):
+                 search_mask=None, list_snapshots=False):
         """Create a new player adapter and configure its capabilities.
         
         Just does some early initializations. Real job starts with start().
@@ -456,6 +693,11 @@ class PlayerAdapter(object):
              list of fields to search the players library for (e.g. artist,
              genre, any, ...) - if set method request_search() should be
              overridden
+        @keyword list_snapshots:
+            keep lists replied by the request methods (e.g.
+            request_playlist()) as snapshots to serve requests for further
+            pages of a list without calling the request methods again - only
+            enable this if invalidate_lists() gets called on list changes
         
         @attention: When overriding, call super class implementation first!
         
@@ -478,6 +720,16 @@ class PlayerAdapter(object):
         self.__item_id = None
         self.__item_info = None
         self.__item_img = None
+        self.__item_serial = 0 # identifies item art jobs
+        self.__item_art = {} # item image scaled per client image parameters
+        self.__item_preview = {} # same as above, but preview size
+        self.__item_art_pending = set() # parameters of running art jobs
+        
+        self.__thumbs = thumbs.ThumbnailCache(self.__config.cache_dir)
+        
+        gobject.threads_init() # art jobs run in worker threads
+        self.__art_jobs = Queue.Queue()
+        self.__art_workers = []
         
         flags = self.__util_calc_flags(playback_known, volume_known,
             repeat_known, shuffle_known, progress_known)
@@ -487,6 +739,11 @@ class PlayerAdapter(object):
         
         self.__sync_triggers = {}
         
+        if list_snapshots:
+            self.__list_snapshots = _ListSnapshots()
+        else:
+            self.__list_snapshots = None
+        
         self.__poll_ival = max(500, int(poll * 1000))
         self.__poll_sid = 0
         
@@ -538,6 +795,13 @@ class PlayerAdapter(object):
             log.debug("poll every %d milli seconds" % self.__poll_ival)
             self.__poll_sid = gobject.timeout_add(self.__poll_ival, self.__poll)
             
+        # set up art workers
+        
+        for i in range(ART_WORKERS):
+            worker = Worker(self.__art_jobs, name="art worker",
+                            current=self.__get_item_serial)
+            worker.start()
+            self.__art_workers.append(worker)
         
         log.debug("start done")
     
@@ -576,10 +840,18 @@ class PlayerAdapter(object):
                 gobject.source_remove(sid)
                 
         self.__sync_triggers = {}
+        
+        if self.__list_snapshots is not None:
+            self.__list_snapshots.invalidate()
 
         if self.__poll_sid > 0:
             gobject.source_remove(self.__poll_sid)
             
+        for worker in self.__art_workers:
+            self.__art_jobs.put(None)
+        self.__art_workers = []
+        self.__item_art_pending.clear()
+        
         log.debug("stop done")
     
     def poll(self):
@@ -626,14 +898,14 @@ class PlayerAdapter(object):
             True means first search in thumbnails, False means first search in
             the resource' folder
                                    
-        @return: an image file name (which can be used for update_item()) or
-            None if no image file has been found or if 'resource' is not local
+        @return: an image to use for update_item() - the actual search is
+            done later in a worker thread, so that it does not block the main
+            loop (if no image file is found or if 'resource' is not local,
+            the item has no image)
         
         """
         
-        file = art.get_art(resource, prefer_thumbnail=prefer_thumbnail)
-        log.debug("image for '%s': %s" % (resource, file))
-        return file
+        return art.Lookup(resource, prefer_thumbnail=prefer_thumbnail)
     
     # =========================================================================
     # control interface 
@@ -1139,9 +1411,13 @@ class PlayerAdapter(object):
             meta information (dict)
         @param img:
             image / cover art (either a file name or URI or an instance of
-            Image.Image)
+            Image.Image or the result of find_image())
         
         @note: Call to synchronize player state with remote clients.
+        
+        @note: The item gets sent to clients without the image first. The
+            image follows as soon as it has been scaled in a worker thread
+            (optionally preceded by a small preview, see Config.art_preview).
 
         @see: find_image() for finding image files for an item.
         
@@ -1159,8 +1435,43 @@ class PlayerAdapter(object):
             self.__item_id = id
             self.__item_info = info
             self.__item_img = img
+            self.__item_serial += 1
+            self.__item_art = {}
+            self.__item_preview = {}
+            self.__item_art_pending.clear()
             self.__sync_trigger(self.__sync_item)
             
+    def invalidate_lists(self, playlist=False, queue=False, mlib=False):
+        """Signal that lists provided by the player have changed.
+        
+        If list snapshots are enabled (see __init__()), once a client
+        requested a list, the complete list is kept as a snapshot to reply
+        requests for further pages of that list without calling the request
+        methods (e.g. request_playlist()) again. Call this method when the
+        content of a list has changed, so that the next request gets replied
+        with fresh data.
+        
+        @keyword playlist: the playlist has changed
+        @keyword queue: the play queue has changed
+        @keyword mlib: the media library (including search results) has
+            changed
+        
+        @note: A request for the first page of a list always gets replied
+            with fresh data.
+        
+        """
+        msg_ids = []
+        if playlist:
+            msg_ids.append(message.REQ_PLAYLIST)
+        if queue:
+            msg_ids.append(message.REQ_QUEUE)
+        if mlib:
+            msg_ids.append(message.REQ_MLIB)
+            msg_ids.append(message.REQ_SEARCH)
+        
+        if self.__list_snapshots is not None:
+            self.__list_snapshots.invalidate(msg_ids)
+        
     # =========================================================================
     # synchronization (outbound communication)
     # =========================================================================
@@ -1213,12 +1524,174 @@ class PlayerAdapter(object):
         
         log.debug("broadcast new item to clients: %s" % self.__item_id)
         
-        for c in self.__clients:
+        keys = self.__send_item(self.__clients)
+        
+        self.__request_art(keys)
+        
+        return False
+    
+    def __send_item(self, clients, low_priority=False):
+        """Send the current item to some clients.
+        
+        The item includes the best image available for a client, i.e. the
+        full size image, the preview image or no image.
+        
+        @return: the image parameters of the clients
+        
+        """
+        # clients with equal image parameters share messages
+        msgs = {}
+        
+        for c in clients:
+            
+            key = self.__item_key(c)
             
-            msg = net.build_message(message.SYNC_ITEM, self.__item(c))
+            try:
+                msg = msgs[key]
+            except KeyError:
+                img = (self.__item_art.get(key) or
+                       self.__item_preview.get(key) or [])
+                msg = net.build_message(message.SYNC_ITEM, self.__item(img))
+                msgs[key] = msg
             
             if msg is not None:
-                c.send(msg)
+                c.send(msg, low_priority=low_priority)
+        
+        return msgs.keys()
+    
+    def __request_art(self, keys):
+        """Request item art for the given client image parameters.
+        
+        Art for parameters which is already available or pending, is not
+        requested again. If previews are enabled, a preview job gets queued
+        ahead of the full size job.
+        
+        """
+        if not self.__item_img:
+            return
+        
+        keys = [k for k in keys if k[0] > 0 and k not in self.__item_art and
+                k not in self.__item_art_pending]
+        
+        if not keys:
+            return
+        
+        self.__item_art_pending.update(keys)
+        
+        serial = self.__item_serial
+        
+        if self.__config.art_preview:
+            
+            keys_preview = [k for k in keys if k[0] > ART_PREVIEW_SIZE]
+            
+            def deliver_preview(art):
+                self.__sync_preview(serial, art)
+                
+            if keys_preview:
+                args = (self.__item_img, keys_preview)
+                self.__art_jobs.put((self.__make_preview, args,
+                                     deliver_preview, serial))
+        
+        def deliver(art):
+            self.__sync_art(serial, keys, art)
+        
+        args = (self.__item_img, keys)
+        
+        self.__art_jobs.put((self.__make_art, args, deliver, serial))
+        
+    def __get_item_serial(self):
+        """Get the current item serial (called by art workers)."""
+        
+        return self.__item_serial
+        
+    def __make_preview(self, img, keys):
+        """Scale an item image to preview size (runs in an art worker thread).
+        
+        @return: a dictionary mapping client image parameters to preview image
+            data - parameters whose full size image is cached already are
+            left out, as a preview would not be any faster
+        
+        """
+        if isinstance(img, art.Lookup):
+            img = img.resolve()
+        
+        art_data = {}
+        for img_size, img_type in keys:
+            if self.__thumbs.cached(img, img_size, img_type):
+                continue
+            small = self.__thumbs.get(img, ART_PREVIEW_SIZE, img_type)
+            if small:
+                art_data[(img_size, img_type)] = small
+        
+        return art_data
+    
+    def __make_art(self, img, keys):
+        """Look up and scale an item image (runs in an art worker thread).
+        
+        @return: a dictionary mapping client image parameters to image data
+        
+        """
+        if isinstance(img, art.Lookup):
+            img = img.resolve()
+        
+        art_data = {}
+        for img_size, img_type in keys:
+            art_data[(img_size, img_type)] = self.__thumbs.get(img, img_size,
+                                                               img_type)
+        
+        return art_data
+    
+    def __sync_preview(self, serial, art_data):
+        """Send an item again, now including a preview of its art."""
+        
+        if self.stopped or serial != self.__item_serial or not art_data:
+            return False
+        
+        # full size art may have been faster
+        art_data = dict([(k, v) for k, v in art_data.items()
+                         if k not in self.__item_art])
+        
+        self.__item_preview.update(art_data)
+        
+        log.debug("broadcast art preview of item to clients: %s" %
+                  self.__item_id)
+        
+        clients = [c for c in self.__clients
+                   if self.__item_key(c) in art_data]
+        
+        self.__send_item(clients)
+        
+        return False
+    
+    def __sync_art(self, serial, keys, art_data):
+        """Send an item again, now including its art."""
+        
+        if self.stopped or serial != self.__item_serial:
+            return False # item has changed in the meantime
+        
+        self.__item_art_pending.difference_update(keys)
+        
+        if art_data is None: # art job failed
+            art_data = dict.fromkeys(keys, [])
+        
+        self.__item_art.update(art_data)
+        
+        log.debug("broadcast art of item to clients: %s" % self.__item_id)
+        
+        # only clients which get (new) art, those which already got a preview
+        # get the full size image when there is nothing else to send
+        clients, clients_preview = [], []
+        for c in self.__clients:
+            key = self.__item_key(c)
+            if not art_data.get(key):
+                continue
+            if key in self.__item_preview:
+                clients_preview.append(c)
+            else:
+                clients.append(c)
+        
+        self.__send_item(clients)
+        self.__send_item(clients_preview, low_priority=True)
         
         return False
     
@@ -1254,8 +1727,9 @@ class PlayerAdapter(object):
             msg = net.build_message(message.SYNC_PROGRESS, self.__progress)
             client.send(msg)
             
-            msg = net.build_message(message.SYNC_ITEM, self.__item(client))
-            client.send(msg)
+            keys = self.__send_item([client])
+            
+            self.__request_art(keys)
             
         else:
             log.error("** BUG ** unexpected message: %d" % id)
@@ -1334,6 +1808,10 @@ class PlayerAdapter(object):
         if a is None:
             return
         
+        # actions are likely to change lists
+        if self.__list_snapshots is not None:
+            self.__list_snapshots.invalidate()
+        
         if id == message.ACT_PLAYLIST:
             
             self.action_playlist_item(a.id, a.positions, a.items)
@@ -1369,8 +1847,32 @@ class PlayerAdapter(object):
         if request is None:
             return
         
+        if id == message.REQ_FILES:
+            snapshots = None # files are cheap to list
+        else:
+            snapshots = self.__list_snapshots
+            
+        snapshot = None
+        if snapshots is not None and request.page > 0:
+            snapshot = snapshots.get(client, id, request.path)
+        
+        if snapshot is not None:
+            
+            log.debug("reply request from snapshot")
+            
+            # do not save the snapshot again, it would never expire
+            reply = ListReply(client, request.request_id, id, request.page,
+                              path=request.path)
+            
+            reply.nested, reply.ids, reply.names, reply.item_actions, \
+                reply.list_actions = snapshot
+                
+            reply.send()
+            
+            return
+        
         reply = ListReply(client, request.request_id, id, request.page,
-                          path=request.path)
+                          path=request.path, snapshots=snapshots)
         
         if id == message.REQ_PLAYLIST:
             
@@ -1402,11 +1904,24 @@ class PlayerAdapter(object):
     # miscellaneous 
     # =========================================================================
     
-    def __item(self, client):
-        """Creates a client specific item object."""
+    def __item(self, img):
+        """Creates an item object with the given (client specific) image data.
+        
+        Image data is available only once it has been scaled for a client's
+        image parameters (see __request_art()).
+        
+        """
+        return Item(self.__item_id, self.__item_info, img)
+        
+    def __item_key(self, client):
+        """Get the parameters which make an item object client specific."""
+        
+        img_size = client.info.img_size
+        
+        if img_size == 0: # no image -> image type does not matter
+            return (0, None)
         
-        return Item(self.__item_id, self.__item_info, self.__item_img,
-                    client.info.img_size, client.info.img_type)
+        return (img_size, client.info.img_type)
         
     def __util_files_to_uris(self, files):
         
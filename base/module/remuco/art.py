@@ -22,13 +22,14 @@
 
 import hashlib
 import os
-import glob
 import os.path
 import re
+import threading
 import urllib
 import urlparse
 import windows
 
+from remuco import embedded
 from remuco import log
 
 TN_DIR = None
@@ -41,6 +42,19 @@ RE_FILE = (r'^%s%s$' % (RE_IND, RE_EXT), # typical name (e.g. front.jpg)
            r'^.*%s$' % RE_EXT) # any image file
 RE_FILE = [re.compile(rx, re.IGNORECASE) for rx in RE_FILE]
 
+FOLDER_CACHE_MAX = 1024 # number of folders to remember art images for
+
+# folder -> (folder mtime, art image file or None)
+__folder_cache = {}
+__folder_cache_lock = threading.Lock()
+
+EMBEDDED_DIR = os.path.join(windows.xdg_cache_home, "remuco", "art")
+EMBEDDED_CACHE_MAX = 4096 # number of files to remember embedded art for
+
+# (file, mtime, size) -> extracted art image file or None
+__embedded_cache = {}
+__embedded_cache_lock = threading.Lock()
+
 def __resource_to_file_uri(resource):
     """Convert a resource to a file URI (file://...).
     
@@ -71,6 +85,10 @@ def __resource_to_file_uri(resource):
 def __get_art_in_folder(uri):
     """Try to find art images in the given URI's folder.
     
+    Results (including misses) are cached per folder as long as the folder's
+    modification time does not change, i.e. as long as no files get added to,
+    removed from or renamed within the folder.
+    
     @param uri:
         a file URI ('file://...')
     
@@ -84,18 +102,136 @@ def __get_art_in_folder(uri):
     path = urllib.url2pathname(elems[2])
     path = os.path.dirname(path)
     
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    
+    cached = __folder_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    
     log.debug("looking for art image in %s" % path)
+    
+    file = __scan_folder(path)
+    
+    __folder_cache_lock.acquire()
+    try:
+        if len(__folder_cache) >= FOLDER_CACHE_MAX:
+            __folder_cache.clear()
+        __folder_cache[path] = (mtime, file)
+    finally:
+        __folder_cache_lock.release()
+    
+    return file
 
-    files = glob.glob(os.path.join(path, "*"))
-    files = [os.path.basename(f) for f in files if os.path.isfile(f)]
+def __scan_folder(path):
+    """Find the best matching art image file in a folder.
+    
+    Names get matched in a single pass over the folder listing, only matching
+    names are checked to be files.
+    
+    """
+    try:
+        names = os.listdir(path)
+    except OSError, e:
+        log.debug("failed to list %s (%s)" % (path, e))
+        return None
     
-    for rx in RE_FILE:
-        for file in files:
-            if rx.match(file):
-                return os.path.join(path, file)
+    candidates = [[] for rx in RE_FILE]
+    
+    for name in names:
+        if name.startswith("."):
+            continue
+        for i, rx in enumerate(RE_FILE):
+            if rx.match(name):
+                candidates[i].append(name)
+                break
+    
+    for names in candidates:
+        for name in names:
+            file = os.path.join(path, name)
+            if os.path.isfile(file):
+                return file
             
     return None
     
+def __get_art_embedded(uri):
+    """Try to find an art image embedded in the given resource.
+    
+    Extracted images are saved in EMBEDDED_DIR, named by their content's hash
+    (tracks of an album usually share the same image). Results (including
+    misses) are cached per file as long as the file does not change.
+    
+    @param uri:
+        a file URI ('file://...')
+    
+    @return:
+        path to an extracted image file or None if the resource has no
+        embedded image
+        
+    """
+    elems = urlparse.urlparse(uri)
+    
+    path = urllib.url2pathname(elems[2])
+    
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    
+    key = (path, st.st_mtime, st.st_size)
+    
+    try:
+        return __embedded_cache[key]
+    except KeyError:
+        pass
+    
+    log.debug("looking for art image in %s" % path)
+    
+    pic = embedded.extract(path)
+    if pic is not None:
+        file = __save_embedded(*pic)
+    else:
+        file = None
+    
+    __embedded_cache_lock.acquire()
+    try:
+        if len(__embedded_cache) >= EMBEDDED_CACHE_MAX:
+            __embedded_cache.clear()
+        __embedded_cache[key] = file
+    finally:
+        __embedded_cache_lock.release()
+    
+    return file
+
+def __save_embedded(mime, data):
+    """Save an extracted image, return its file name or None on failure."""
+    
+    ext = re.sub(r'\W', "", mime.split("/")[-1]) or "img"
+    
+    file = os.path.join(EMBEDDED_DIR, "%s.%s" % (hashlib.md5(data).hexdigest(),
+                                                 ext))
+    if os.path.isfile(file):
+        return file
+    
+    file_tmp = "%s.%d.tmp" % (file, os.getpid())
+    
+    try:
+        if not os.path.isdir(EMBEDDED_DIR):
+            os.makedirs(EMBEDDED_DIR)
+        fp = open(file_tmp, "wb")
+        try:
+            fp.write(data)
+        finally:
+            fp.close()
+        os.rename(file_tmp, file)
+    except (IOError, OSError), e:
+        log.warning("failed to save embedded art image (%s)" % e)
+        return None
+    
+    return file
+    
 def __get_art_from_thumbnails(uri):
     """Try to find a thumbnail for the given resource.
     
@@ -122,7 +258,23 @@ def __get_art_from_thumbnails(uri):
     return None
 
 def get_art(resource, prefer_thumbnail=False):
+    """Find an art image for a resource.
+    
+    Art images get searched in the resource's folder, embedded in the resource
+    itself and in the thumbnail directory. Art in the folder is preferred
+    (first choice of most users tagging their collection), except when
+    'prefer_thumbnail' is True - then resource specific art (thumbnail,
+    embedded image) is preferred.
     
+    @param resource:
+        a local path or an URI (string)
+    @keyword prefer_thumbnail:
+        see above
+    
+    @return:
+        path to an image file or None if there is no art image
+        
+    """
     if resource is None:
         return None
     
@@ -132,17 +284,57 @@ def get_art(resource, prefer_thumbnail=False):
         return None
     
     if prefer_thumbnail:
-        file = __get_art_from_thumbnails(uri)
+        strategies = (__get_art_from_thumbnails, __get_art_embedded,
+                      __get_art_in_folder)
+    else:
+        strategies = (__get_art_in_folder, __get_art_embedded,
+                      __get_art_from_thumbnails)
+    
+    for strategy in strategies:
+        file = strategy(uri)
         if file is not None:
             return file
+    
+    return None
+
+class Lookup(object):
+    """A deferred art image lookup.
+    
+    Wraps the parameters of get_art(), so that the actual (possibly slow)
+    lookup can be done later and outside the main loop by calling resolve().
+    
+    """
+    def __init__(self, resource, prefer_thumbnail=False):
         
-    file = __get_art_in_folder(uri)
-    if file is not None:
-        return file
+        self.resource = resource
+        self.prefer_thumbnail = prefer_thumbnail
+        
+    def __eq__(self, other):
+        
+        if not isinstance(other, Lookup):
+            return False
+        
+        return (self.resource == other.resource and
+                self.prefer_thumbnail == other.prefer_thumbnail)
+        
+    def __ne__(self, other):
+        
+        return not self.__eq__(other)
     
-    if not prefer_thumbnail:
-        file = __get_art_from_thumbnails(uri)
-        if file is not None:
-            return file
+    def __hash__(self):
+        
+        return hash((self.resource, self.prefer_thumbnail))
     
-    return None
\ No newline at end of file
+    def __str__(self):
+        
+        return "art of '%s'" % self.resource
+    
+    def resolve(self):
+        """Do the lookup.
+        
+        @return: see get_art()
+        
+        """
+        file = get_art(self.resource, prefer_thumbnail=self.prefer_thumbnail)
+        log.debug("image for '%s': %s" % (self.resource, file))
+        return file
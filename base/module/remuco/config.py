@@ -37,7 +37,7 @@ DEVICE_FILE = os.path.join(xdg_cache, "remuco", "devices")
 SEC = ConfigParser.DEFAULTSECT
 
 CONFIG_VERSION_MAJOR = "1"
-CONFIG_VERSION_MINOR = "5"
+CONFIG_VERSION_MINOR = "6"
 CONFIG_VERSION = "%s.%s" % (CONFIG_VERSION_MAJOR, CONFIG_VERSION_MINOR)
 
 KEY_CONFIG_VERSION = "config-version"
@@ -52,6 +52,7 @@ KEY_FB_SHOW_EXT = "file-browser-show-extensions"
 KEY_FB_ROOT_DIRS = "file-browser-root-dirs"
 KEY_FB_XDG_UD = "file-browser-use-xdg-user-dirs"
 KEY_MPRIS_JUMP = "mpris-jump"
+KEY_ART_PREVIEW = "art-preview-enabled"
 
 DEFAULTS = { # values as saved in config file
     KEY_BLUETOOTH: "1",
@@ -64,7 +65,8 @@ DEFAULTS = { # values as saved in config file
     KEY_FB_SHOW_EXT: "0",
     KEY_FB_ROOT_DIRS: "",
     KEY_FB_XDG_UD: "1",
-    KEY_MPRIS_JUMP: "0" }
+    KEY_MPRIS_JUMP: "0",
+    KEY_ART_PREVIEW: "0" }
 
 class Config(object):
     """Class for getting and setting player adapter specific configurations.
@@ -537,6 +539,34 @@ class Config(object):
     mprisjump = property(__pget_mprisjump, __pset_mprisjump, None, 
                          __pget_mprisjump.__doc__)
 
+    # === property: art_preview ===
+    
+    def __pget_art_preview(self):
+        """Flag if item images get sent as a small preview first.
+        
+        If enabled, clients get a small preview of an item's image first, the
+        full size image follows when there is nothing else to send. This
+        speeds up item changes on slow connections (e.g. Bluetooth).
+        
+        Default: False (disable)
+        
+        Option name: 'art-preview-enabled'
+        
+        """
+        try:
+            return self.__cp.getboolean(SEC, KEY_ART_PREVIEW)
+        except (ValueError, AttributeError), e:
+            log.warning("config '%s' malformed (%s)" % (KEY_ART_PREVIEW, e))
+            return False
+    
+    def __pset_art_preview(self, value):
+    
+        self.__cp.set(SEC, KEY_ART_PREVIEW, str(value))
+        self.__save()
+    
+    art_preview = property(__pget_art_preview, __pset_art_preview, None,
+                           __pget_art_preview.__doc__)
+
     # === property: config_dir ===
     
     def __pget_config_dir(self):
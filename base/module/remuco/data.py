@@ -22,12 +22,6 @@
 
 """Data containers to send to and receive from clients."""
 
-import tempfile
-import Image
-import urlparse
-import urllib
-
-from remuco import log
 from remuco import serial
 
 # =============================================================================
@@ -115,11 +109,17 @@ class Progress(serial.Serializable):
 class Item(serial.Serializable):
     """ Parameter of the item sync message sent to clients."""
     
-    def __init__(self, id, info, img, img_size, img_type):
+    def __init__(self, id, info, img):
+        """Create a new item.
+        
+        @param img:
+            image data scaled for a client (see thumbs.thumbnail()), may be an
+            empty list
         
+        """
         self.__id = id
         self.__info = self.__flatten_info(info)
-        self.__img = self.__thumbnail_img(img, img_size, img_type)
+        self.__img = img
         
     def __str__(self):
         
@@ -152,35 +152,11 @@ class Item(serial.Serializable):
                 
         return info_list
 
-    def __thumbnail_img(self, img, img_size, img_type):
-    
-        if img_size == 0:
-            return []
-    
-        if isinstance(img, basestring) and img.startswith("file://"):
-            img = urlparse.urlparse(img)[2]
-            img = urllib.url2pathname(img)
-            
-        if not img:
-            return []
-    
-        try:
-            if not isinstance(img, Image.Image):
-                img = Image.open(img)
-            img.thumbnail((img_size, img_size))
-            file_tmp = tempfile.TemporaryFile()
-            img.save(file_tmp, img_type)
-            file_tmp.seek(0)
-            thumb = file_tmp.read()
-            file_tmp.close()
-            return thumb
-        except IOError, e:
-            log.warning("failed to thumbnail %s (%s)" % (img, e))
-            return []
-
 class ItemList(serial.Serializable):
     """ Parameter of a request reply message sent to clients."""
     
+    CACHED_FIELDS = (3, 4) # item IDs and names
+    
     def __init__(self, request_id, path, nested, item_ids, item_names,
                  item_offset, page, page_max, item_actions, list_actions):
         
@@ -0,0 +1,333 @@
+# =============================================================================
+#
+#    Remuco - A remote control system for media players.
+#    Copyright (C) 2006-2010 by the Remuco team, see AUTHORS.
+#
+#    This file is part of Remuco.
+#
+#    Remuco is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Remuco is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Remuco.  If not, see <http://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""Extraction of art images embedded in audio files.
+
+Supported are ID3v2 tags (APIC/PIC frames, e.g. in MP3 files), FLAC PICTURE
+metadata blocks and MP4 cover atoms (e.g. in M4A files). The file type is
+detected by content, not by name. Only tag structures get read, never the
+audio data.
+
+"""
+
+import struct
+
+from remuco import log
+
+MAX_SIZE = 16777216 # maximum size of a tag resp. an image to read
+
+PIC_TYPE_FRONT = 3 # picture type 'front cover' (ID3v2 and FLAC)
+
+ID3_PIC_FORMATS = {"JPG": "image/jpeg", "PNG": "image/png"} # ID3v2.2 only
+
+MP4_COVR_PATH = ("moov", "udta", "meta", "ilst", "covr", "data")
+MP4_DATA_TYPES = {13: "image/jpeg", 14: "image/png", 27: "image/bmp"}
+
+class _FormatError(Exception):
+    pass
+
+def extract(path):
+    """Extract an art image from an audio file.
+
+    @param path:
+        audio file path
+
+    @return:
+        a tuple of the image's mime type and the image data, or None if the
+        file does not contain an image (or if the file type is not supported)
+
+    """
+    try:
+        fp = open(path, "rb")
+    except IOError, e:
+        log.debug("failed to open %s (%s)" % (path, e))
+        return None
+
+    try:
+        try:
+            head = fp.read(12)
+            if head.startswith("ID3"):
+                fp.seek(0)
+                pic = __id3(fp)
+                if pic is None: # maybe a FLAC file with a leading ID3 tag
+                    if fp.read(4) == "fLaC":
+                        pic = __flac(fp)
+                return pic
+            if head.startswith("fLaC"):
+                fp.seek(4)
+                return __flac(fp)
+            if head[4:8] == "ftyp":
+                fp.seek(0)
+                return __mp4(fp)
+            return None
+        except (IOError, ValueError, IndexError, struct.error,
+                _FormatError), e:
+            log.debug("failed to read embedded art of %s (%s)" % (path, e))
+            return None
+    finally:
+        fp.close()
+
+def __read(fp, size):
+    """Read exactly 'size' bytes."""
+
+    if size > MAX_SIZE:
+        raise _FormatError("size %d exceeds limit" % size)
+
+    data = fp.read(size)
+    if len(data) != size:
+        raise _FormatError("unexpected end of file")
+
+    return data
+
+def __syncsafe(data):
+
+    value = 0
+    for c in data:
+        value = (value << 7) | (ord(c) & 0x7F)
+    return value
+
+# =============================================================================
+# ID3v2
+# =============================================================================
+
+def __id3(fp):
+    """Read ID3v2 APIC (resp. PIC) frames.
+
+    The file position afterwards is the end of the tag.
+
+    """
+    header = __read(fp, 10)
+    version = ord(header[3])
+    flags = ord(header[5])
+    size = __syncsafe(header[6:10])
+
+    if version not in (2, 3, 4):
+        fp.seek(size, 1)
+        return None
+
+    tag = __read(fp, size)
+
+    if flags & 0x80 and version < 4: # whole tag unsynchronized
+        tag = tag.replace("\xff\x00", "\xff")
+
+    pos = 0
+
+    if flags & 0x40 and version == 3: # extended header
+        pos = struct.unpack(">I", tag[0:4])[0] + 4
+    elif flags & 0x40 and version == 4:
+        pos = __syncsafe(tag[0:4])
+
+    pic = None
+
+    if version == 2:
+        hlen, frame_id = 6, "PIC"
+    else:
+        hlen, frame_id = 10, "APIC"
+
+    while pos + hlen <= len(tag):
+
+        fid = tag[pos:pos+len(frame_id)]
+
+        if fid.strip("\x00") == "": # padding
+            break
+
+        if version == 2:
+            fid = tag[pos:pos+3]
+            fsize = struct.unpack(">I", "\x00" + tag[pos+3:pos+6])[0]
+            fflags = 0
+        elif version == 3:
+            fid = tag[pos:pos+4]
+            fsize = struct.unpack(">I", tag[pos+4:pos+8])[0]
+            fflags = struct.unpack(">H", tag[pos+8:pos+10])[0]
+        else:
+            fid = tag[pos:pos+4]
+            fsize = __syncsafe(tag[pos+4:pos+8])
+            fflags = struct.unpack(">H", tag[pos+8:pos+10])[0]
+
+        data = tag[pos+hlen:pos+hlen+fsize]
+        pos += hlen + fsize
+
+        if fid != frame_id:
+            continue
+
+        data = __id3_frame_data(version, fflags, data)
+        if data is None:
+            continue
+
+        pic_type, mime, img = __id3_apic(version, data)
+
+        if pic_type == PIC_TYPE_FRONT:
+            return mime, img
+        if pic is None:
+            pic = (mime, img)
+
+    return pic
+
+def __id3_frame_data(version, flags, data):
+    """Undo frame level encodings, return None if that is not possible."""
+
+    if version == 3:
+        if flags & 0x00C0: # compressed or encrypted
+            return None
+        if flags & 0x0020: # grouping identity
+            data = data[1:]
+    elif version == 4:
+        if flags & 0x000C: # compressed or encrypted
+            return None
+        if flags & 0x0040: # grouping identity
+            data = data[1:]
+        if flags & 0x0001: # data length indicator
+            data = data[4:]
+        if flags & 0x0002: # unsynchronized
+            data = data.replace("\xff\x00", "\xff")
+
+    return data
+
+def __id3_apic(version, data):
+    """Parse an APIC (resp. PIC) frame.
+
+    @return: a tuple of picture type, mime type and image data
+
+    """
+    encoding = ord(data[0])
+
+    if version == 2:
+        mime = ID3_PIC_FORMATS.get(data[1:4].upper(), "image/%s" %
+                                   data[1:4].lower())
+        pos = 4
+    else:
+        end = data.index("\x00", 1)
+        mime = data[1:end].lower() or "image/jpeg"
+        if "/" not in mime: # some taggers write e.g. 'jpg' only
+            mime = ID3_PIC_FORMATS.get(mime.upper(), "image/%s" % mime)
+        pos = end + 1
+
+    pic_type = ord(data[pos])
+    pos += 1
+
+    # skip description
+    if encoding in (1, 2): # UTF-16, terminated by 2 aligned null bytes
+        while data[pos:pos+2] not in ("\x00\x00", ""):
+            pos += 2
+        pos += 2
+    else:
+        pos = data.index("\x00", pos) + 1
+
+    return pic_type, mime, data[pos:]
+
+# =============================================================================
+# FLAC
+# =============================================================================
+
+def __flac(fp):
+    """Read FLAC PICTURE blocks (file position must be after 'fLaC')."""
+
+    pic = None
+
+    while True:
+
+        header = __read(fp, 4)
+        last = ord(header[0]) & 0x80
+        block_type = ord(header[0]) & 0x7F
+        size = struct.unpack(">I", "\x00" + header[1:4])[0]
+
+        if block_type == 6: # PICTURE
+            data = __read(fp, size)
+            pic_type, mime_len = struct.unpack(">II", data[0:8])
+            mime = data[8:8+mime_len].lower()
+            pos = 8 + mime_len
+            desc_len = struct.unpack(">I", data[pos:pos+4])[0]
+            pos += 4 + desc_len + 16 # skip description, dimensions and colors
+            img_len = struct.unpack(">I", data[pos:pos+4])[0]
+            img = data[pos+4:pos+4+img_len]
+            if pic_type == PIC_TYPE_FRONT:
+                return mime, img
+            if pic is None:
+                pic = (mime, img)
+        else:
+            fp.seek(size, 1)
+
+        if last:
+            return pic
+
+# =============================================================================
+# MP4
+# =============================================================================
+
+def __mp4(fp):
+    """Read the cover atom of an MP4 file."""
+
+    end = None # end of the current parent atom (None means end of file)
+
+    for name in MP4_COVR_PATH:
+
+        size = __mp4_find(fp, name, end)
+        if size is None:
+            return None
+
+        end = fp.tell() + size
+
+        if name == "meta": # full atom, skip version and flags
+            fp.seek(4, 1)
+
+    data = __read(fp, size)
+    data_type = struct.unpack(">I", data[0:4])[0] & 0xFFFFFF
+    mime = MP4_DATA_TYPES.get(data_type, "image/jpeg")
+
+    return mime, data[8:] # skip type and locale
+
+def __mp4_find(fp, name, end):
+    """Seek to the content of the next atom with the given name.
+
+    @return: the content size of the atom or None if there is no such atom
+        until position 'end'
+
+    """
+    while end is None or fp.tell() + 8 <= end:
+
+        header = fp.read(8)
+        if len(header) < 8:
+            return None
+
+        size, atom = struct.unpack(">I4s", header)
+
+        if size == 1: # 64 bit size
+            size = struct.unpack(">Q", __read(fp, 8))[0] - 16
+        elif size == 0: # atom extends to end of file resp. parent
+            if atom != name:
+                return None
+            pos = fp.tell()
+            fp.seek(0, 2)
+            size = (end or fp.tell()) - pos
+            fp.seek(pos)
+        else:
+            size -= 8
+
+        if size < 0:
+            raise _FormatError("invalid atom size")
+
+        if atom == name:
+            return size
+
+        fp.seek(size, 1)
+
+    return None
@@ -48,6 +48,8 @@ STATUS_STOPPED = 2
 
 MINFO_KEY_RATING = "rating"
 
+FETCH_WINDOW = 16 # maximum number of pending GetMetadata() calls per fetch
+
 # =============================================================================
 # actions
 # =============================================================================
@@ -113,6 +115,12 @@ class MPRISAdapter(PlayerAdapter):
         self.__can_next = False
         self.__can_prev = False
         self.__can_tracklist = False
+        self.__tracklist_fetches = {}
+        self.__tracklist = None # mirror of the player's tracklist
+        self.__tracklist_waiters = None # not None while syncing the mirror
+        self.__tracklist_sync_id = 0
+        self.__tracklist_expected = [] # lengths after own changes, see
+                                       # __tracklist_deleted()
         
         log.debug("init done")
 
@@ -165,6 +173,12 @@ class MPRISAdapter(PlayerAdapter):
             
         self.__dbus_signal_handler = ()
         
+        self.__tracklist_fetches.clear()
+        self.__tracklist = None
+        self.__tracklist_waiters = None
+        self.__tracklist_sync_id += 1
+        self.__tracklist_expected = []
+        
         self._mp_p = None
         self._mp_t = None
         
@@ -297,6 +311,7 @@ class MPRISAdapter(PlayerAdapter):
             try:
                 for pos in positions:
                     self._mp_t.DelTrack(pos)
+                    self.__tracklist_deleted(pos)
             except DBusException, e:
                 log.warning("dbus error: %s" % e)
                 return
@@ -318,20 +333,8 @@ class MPRISAdapter(PlayerAdapter):
             reply.send()
             return
         
-        # TODO: very slow for SongBird, should be async
-        tracks = self.__get_tracklist()
-
-        for track in tracks:
-            id, info = self.__track2info(track)
-            artist = info.get(INFO_ARTIST, "???")
-            title = info.get(INFO_TITLE, "???")
-            name = "%s - %s" % (artist, title)
-            reply.ids.append(id)
-            reply.names.append(name)
-        
-        reply.item_actions = self.__playlist_actions
-        
-        reply.send()
+        self.__get_tracklist(lambda tracks: self.__reply_playlist(reply,
+                                                                  tracks))
 
     # =========================================================================
     # internal methods (may be overridden by subclasses to fix MPRIS issues) 
@@ -411,6 +414,13 @@ class MPRISAdapter(PlayerAdapter):
     def _notify_tracklist_change(self, new_len):
         
         log.debug("tracklist change")
+        
+        self.invalidate_lists(playlist=True)
+        
+        if self.__tracklist is not None or self.__tracklist_waiters is not None:
+            self.__tracklist_fetches.clear() # results would be outdated
+            self.__sync_tracklist(new_len)
+        
         try:
             self._mp_t.GetCurrentTrack(reply_handler=self._notify_position,
                                        error_handler=self._dbus_error)
@@ -446,27 +456,237 @@ class MPRISAdapter(PlayerAdapter):
     # internal methods (private) 
     # =========================================================================
     
-    def __get_tracklist(self):
-        """Get a list of track dicts of all tracks in the tracklist."""
+    def __fetch_tracklist(self, callback, start=0, count=None):
+        """Asynchronously get track dicts of tracks in the tracklist.
+        
+        GetMetadata() calls for the requested range get sent asynchronously,
+        with at most FETCH_WINDOW calls pending at a time (each reply handler
+        sends the next call), so that a long tracklist does not flood the
+        player with requests. Once all tracks are
+        available, 'callback' gets called with the list of track dicts (None
+        on errors). Requests for a range which is already being
+        fetched get coalesced with the pending fetch.
+        
+        @param callback:
+            function to call with the list of track dicts
+        @keyword start:
+            position of the first track to get
+        @keyword count:
+            number of tracks to get (None means up to the end of the tracklist)
+        
+        """
+        key = (start, count)
+        
+        if key in self.__tracklist_fetches:
+            self.__tracklist_fetches[key].append(callback)
+            return
+        
+        callbacks = [callback]
+        self.__tracklist_fetches[key] = callbacks
+        
+        if count is not None:
+            self.__fetch_tracks(key, callbacks, start, count)
+            return
         
         try:
-            length = self._mp_t.GetLength()
+            self._mp_t.GetLength(
+                reply_handler=lambda length: self.__fetch_tracks(key,
+                                            callbacks, start, length - start),
+                error_handler=lambda error: self.__fetch_tracks_done(key,
+                                            callbacks, None, error))
         except DBusException, e:
-            log.warning("dbus error: %s" % e)
-            length = 0
+            self.__fetch_tracks_done(key, callbacks, None, e)
+            
+    def __fetch_tracks(self, key, callbacks, start, count):
+        
+        if count <= 0:
+            self.__fetch_tracks_done(key, callbacks, [])
+            return
         
-        if length == 0:
-            return []
+        tracks = [None] * count
+        pending = [count]
+        next = [0] # index of the next track to request
+        
+        def request():
+            i = next[0]
+            next[0] += 1
+            self._mp_t.GetMetadata(start + i,
+                reply_handler=lambda track: reply(i, track),
+                error_handler=error)
+        
+        def reply(i, track):
+            if self.__tracklist_fetches.get(key) is not callbacks:
+                return # fetch failed already or adapter has been stopped
+            tracks[i] = track
+            pending[0] -= 1
+            if pending[0] == 0:
+                self.__fetch_tracks_done(key, callbacks, tracks)
+            elif next[0] < count:
+                try:
+                    request()
+                except DBusException, e:
+                    error(e)
+        
+        def error(error):
+            self.__fetch_tracks_done(key, callbacks, None, error)
         
-        tracks = []
-        for i in range(0, length):
-            try:
-                tracks.append(self._mp_t.GetMetadata(i))
-            except DBusException, e:
-                log.warning("dbus error: %s" % e)
-                return []
+        try:
+            for i in range(min(count, FETCH_WINDOW)):
+                request()
+        except DBusException, e:
+            error(e)
+    
+    def __fetch_tracks_done(self, key, callbacks, tracks, error=None):
+        
+        if self.__tracklist_fetches.get(key) is not callbacks:
+            return # fetch failed already or adapter has been stopped
+        
+        del self.__tracklist_fetches[key]
+        
+        if error is not None:
+            log.warning("dbus error: %s" % error)
+            tracks = None
+        
+        for callback in callbacks:
+            callback(tracks)
+        
+    def __get_tracklist(self, callback):
+        """Call 'callback' with the tracklist mirror once it is up to date.
+        
+        If the mirror has not been populated yet, the complete tracklist gets
+        fetched. On errors, 'callback' gets called with an empty list.
+        
+        """
+        if self.__tracklist is not None and self.__tracklist_waiters is None:
+            callback(self.__tracklist)
+            return
+        
+        if self.__tracklist_waiters is None:
+            self.__sync_tracklist(None)
+        
+        if self.__tracklist_waiters is not None:
+            self.__tracklist_waiters.append(callback)
+        else: # sync failed immediately
+            callback(self.__tracklist or [])
+    
+    def __sync_tracklist(self, new_len):
+        """Update the tracklist mirror to a changed tracklist.
+        
+        MPRIS only tells the new length of a changed tracklist. Length changes
+        caused by our own deletions and additions are already reflected by the
+        mirror (as long as the lengths match the expected ones). If
+        the tracklist has grown and the last mirrored track is still in place,
+        only the new tracks get fetched. In any other case (or if 'new_len' is
+        None) the complete tracklist gets fetched again.
+        
+        """
+        in_sync = self.__tracklist_waiters is not None
+        if not in_sync:
+            self.__tracklist_waiters = []
+        
+        self.__tracklist_sync_id += 1
+        sync_id = self.__tracklist_sync_id
+        
+        mirror = self.__tracklist
+        expected = self.__tracklist_expected
+        self.__tracklist_expected = []
+        
+        if in_sync or mirror is None or new_len is None:
+            pass # full sync
+        
+        elif expected:
+            # one change notification per own change is still to come
+            if new_len == expected[0]:
+                self.__tracklist_expected = expected[1:]
+                self.__sync_tracklist_done(sync_id, mirror)
+                return
             
-        return tracks
+        elif new_len > len(mirror):
+            start = max(len(mirror) - 1, 0)
+            self.__fetch_tracklist(lambda tracks: self.__sync_tracklist_tail(
+                                   sync_id, new_len - start, tracks),
+                                   start, new_len - start)
+            return
+        
+        log.debug("fetch complete tracklist")
+        
+        self.__fetch_tracklist(lambda tracks: self.__sync_tracklist_done(
+                               sync_id, tracks))
+        
+    def __sync_tracklist_tail(self, sync_id, count, tracks):
+        
+        if sync_id != self.__tracklist_sync_id:
+            return # superseded by a more recent sync
+        
+        mirror = self.__tracklist
+        
+        if tracks is None or len(tracks) != count:
+            self.__sync_tracklist_done(sync_id, None)
+        elif not mirror:
+            self.__sync_tracklist_done(sync_id, tracks)
+        elif tracks[0].get("location") == mirror[-1].get("location"):
+            log.debug("%d tracks appended to tracklist" % (count - 1))
+            self.__sync_tracklist_done(sync_id, mirror + tracks[1:])
+        else:
+            # tracklist changed somewhere else, too
+            self.__sync_tracklist(None)
+        
+    def __sync_tracklist_done(self, sync_id, tracks):
+        
+        if sync_id != self.__tracklist_sync_id:
+            return # superseded by a more recent sync
+        
+        self.__tracklist = tracks
+        
+        waiters = self.__tracklist_waiters or []
+        self.__tracklist_waiters = None
+        
+        for callback in waiters:
+            callback(tracks or [])
+            
+    def __tracklist_deleted(self, position):
+        """Reflect a track deletion done by this adapter in the mirror.
+        
+        The tracklist length expected after the deletion gets remembered, so
+        that the corresponding change notification does not trigger a sync.
+        
+        """
+        if self.__tracklist is None or self.__tracklist_waiters is not None:
+            return # sync in progress, picks up the deletion anyway
+        
+        if position < len(self.__tracklist):
+            del self.__tracklist[position]
+            self.__tracklist_expected.append(len(self.__tracklist))
+        
+    def __tracklist_added(self, track):
+        """Reflect a track addition done by this adapter in the mirror.
+        
+        Same as __tracklist_deleted(), but for a track appended to the
+        tracklist.
+        
+        """
+        if self.__tracklist is None or self.__tracklist_waiters is not None:
+            return # sync in progress, picks up the addition anyway
+        
+        self.__tracklist.append(track)
+        self.__tracklist_expected.append(len(self.__tracklist))
+        
+    def __reply_playlist(self, reply, tracks):
+        
+        def get_page(start, count):
+            items = []
+            for track in tracks[start:start + count]:
+                id, info = self.__track2info(track)
+                artist = info.get(INFO_ARTIST, "???")
+                title = info.get(INFO_TITLE, "???")
+                items.append((id, "%s - %s" % (artist, title)))
+            return items
+        
+        reply.set_provider(len(tracks), get_page)
+        
+        reply.item_actions = self.__playlist_actions
+        
+        reply.send()
 
     def __track2info(self, track):
         """Convert an MPRIS meta data dict to a Remuco info dict."""
@@ -493,20 +713,30 @@ class MPRISAdapter(PlayerAdapter):
         behaves not as expected on dynamic playlists.
         
         """
-        tracks = self.__get_tracklist()
+        self.__get_tracklist(lambda tracks: self.__jump_to_tracks(position,
+                             tracks[position:]))
         
-        if position >= len(tracks):
+    def __jump_to_tracks(self, position, tracks):
+        """Jump to a position, given the tracks from that position on."""
+        
+        if not tracks:
             return
         
         uris = []
-        for track in tracks[position:]:
+        for track in tracks:
             uris.append(track.get("location", "there must be a location"))
         
-        positions = range(position, len(tracks))
+        positions = range(position, position + len(tracks))
         
         self.action_playlist_item(IA_REMOVE.id, positions, uris)
         
-        self.action_files(IA_APPEND_PLAY.id, [], uris)
+        # tracks are known already, so the mirror does not need to fetch them
+        try:
+            for i in range(len(tracks)):
+                self._mp_t.AddTrack(uris[i], i == 0)
+                self.__tracklist_added(tracks[i])
+        except DBusException, e:
+            log.warning("dbus error: %s" % e)
     
     # =========================================================================
     # dbus reply handler (may be reused by subclasses) 
@@ -20,6 +20,7 @@
 #
 # =============================================================================
 
+from collections import deque
 import errno
 import socket
 import struct
@@ -43,7 +44,7 @@ def build_message(id, serializable):
         message content (object of type Serializable)
     
     @return:
-        the message as a binary string or None if serialization failed
+        the message as a bytearray or None if serialization failed
         
     """
     
@@ -52,31 +53,32 @@ def build_message(id, serializable):
     # Using this method, a message can be serialized once and send to many
     # clients.
     
+    hlen = ClientConnection.IO_HEADER_LEN
+    
     if serializable is not None:
-        ba = serial.pack(serializable)
-        if ba is None:
+        # serialize with space for the header -> no copying to prepend header
+        msg = serial.pack(serializable, reserve=hlen)
+        if msg is None:
             log.warning("failed to serialize (msg-id %d)" % id)
             return None
     else:
-        ba = ""
+        msg = bytearray(hlen)
     
-    header = struct.pack("!hi", id, len(ba))
+    struct.pack_into("!hi", msg, 0, id, len(msg) - hlen)
     
-    return "%s%s" % (header, ba)
+    return msg
 
-class ReceiveBuffer(object):
-    """ A box to pool some receive buffer related data. """
-    
-    def __init__(self):
-        
-        self.header = ""
-        self.data = ""
-        self.rest = 0
-        
 class ClientConnection(object):
     
     IO_HEADER_LEN = 6
     IO_MSG_MAX_SIZE = 10240 # prevent DOS
+    IO_RCV_BUFF_SIZE = 2 * (IO_HEADER_LEN + IO_MSG_MAX_SIZE)
+    IO_SND_QUEUE_MAX_SIZE = 1048576 # disconnect clients which are too slow
+    IO_SND_CHUNK_MAX_SIZE = 65536 # max bytes of queued messages to join
+    
+    # outgoing messages which supersede queued messages of the same type
+    IO_SND_COALESCE = (message.SYNC_STATE, message.SYNC_PROGRESS,
+                       message.SYNC_ITEM)
     
     IO_PREFIX = '\xff\xff\xff\xff'
     IO_SUFFIX = '\xfe\xfe\xfe\xfe'
@@ -96,14 +98,17 @@ class ClientConnection(object):
         self.info = ClientInfo()
         self.__psave = False
         
-        # the following fields are used for iterative receiving on message data
-        # see io_recv() and io_recv_buff()
-        self.__rcv_buff_header = ReceiveBuffer()
-        self.__rcv_buff_data = ReceiveBuffer()
-        self.__rcv_msg_id = message.IGNORE
-        self.__rcv_msg_size = 0
+        # receive buffer, contains incomplete messages between receive calls
+        # see __io_recv() and __recv_into()
+        self.__rcv_buff = bytearray(ClientConnection.IO_RCV_BUFF_SIZE)
+        self.__rcv_view = memoryview(self.__rcv_buff)
+        self.__rcv_len = 0 # bytes in receive buffer
         
-        self.__snd_buff = "" # buffer for outgoing data
+        # outgoing messages, as (msg-id, data) tuples
+        self.__snd_queue = deque()
+        self.__snd_queue_low = deque() # sent when nothing else is queued
+        self.__snd_queue_size = 0 # bytes in queues not yet sent
+        self.__snd_offset = 0 # bytes of the first message already sent
         
         # source IDs for various events
         self.__sids = [
@@ -125,94 +130,90 @@ class ClientConnection(object):
     # io
     #==========================================================================
     
-    def __recv_buff(self, rcv_buff):
-        """ Receive some data and put it into the given ReceiveBuffer.
+    def __recv_into(self, view):
+        """ Receive some data into the given part of the receive buffer.
         
-        @param rcv_buff: the receive buffer to put received data into
+        @param view: memoryview on the receive buffer part to fill
         
-        @return: true if some data has been received, false if an error occurred
+        @return: number of bytes received or 0 if an error occurred
         """
        
         try:
-            log.debug("try to receive %d bytes" % rcv_buff.rest)
-            data = self.__sock.recv(rcv_buff.rest)
+            try:
+                received = self.__sock.recv_into(view)
+            except (AttributeError, TypeError): # no or limited recv_into()
+                data = self.__sock.recv(len(view))
+                received = len(data)
+                view[:received] = data
         except socket.timeout, e: # TODO: needed?
             log.warning("connection to %s broken (%s)" % (self, e))
             self.disconnect()
-            return False
+            return 0
         except socket.error, e:
             log.warning("connection to %s broken (%s)" % (self, e))
             self.disconnect()
-            return False
-        
-        received = len(data)
-        
-        log.debug("received %d bytes" % received)
+            return 0
         
         if received == 0:
             log.warning("connection to %s broken (no data)" % self)
             self.disconnect()
-            return False
-        
-        rcv_buff.data = "%s%s" % (rcv_buff.data, data)
-        rcv_buff.rest -= received
-        
-        return True
+            return 0
         
+        return received
     
     def __io_recv(self, fd, cond):
-        """ GObject callback function (when there is data to receive). """
+        """ GObject callback function (when there is data to receive).
         
-        log.debug("data from client %s available" % self)
-
-        # --- init buffers on new message -------------------------------------
-
-        if (self.__rcv_buff_header.rest + self.__rcv_buff_data.rest == 0):
-
-            self.__rcv_msg_id = message.IGNORE
-            self.__rcv_msg_size = 0 # will be set later
-            
-            self.__rcv_buff_header.data = ""
-            self.__rcv_buff_header.rest = ClientConnection.IO_HEADER_LEN
-            self.__rcv_buff_data.data = ""
-            self.__rcv_buff_data.rest = 0 # will be set later
-    
-        # --- receive header --------------------------------------------------
-
-        if self.__rcv_buff_header.rest > 0:
+        Receives as much data as currently fits into the receive buffer and
+        handles all complete messages contained therein.
+        
+        """
+        
+        hlen = ClientConnection.IO_HEADER_LEN
+        buff = self.__rcv_buff
+        
+        # there is always free space: complete messages get handled below and
+        # an incomplete one is smaller than half of the buffer
+        received = self.__recv_into(self.__rcv_view[self.__rcv_len:])
+        if not received:
+            return False
+        
+        self.__rcv_len += received
+        
+        start = 0
+        
+        while self.__rcv_len - start >= hlen:
             
-            ok = self.__recv_buff(self.__rcv_buff_header)
-            if not ok:
-                return False
-            if self.__rcv_buff_header.rest > 0:
-                return True # more data to read, come back later
-            id, size = struct.unpack('!hi', self.__rcv_buff_header.data)
-            if size > ClientConnection.IO_MSG_MAX_SIZE:
+            id, size = struct.unpack_from('!hi', buff, start)
+            if size > ClientConnection.IO_MSG_MAX_SIZE or size < 0:
                 log.warning("msg from %s too big (%d bytes)" % (self, size))
                 self.disconnect()
                 return False
-            log.debug("incoming msg: %d, %dB" % (id, size))
-            self.__rcv_buff_data.rest = size
-            self.__rcv_msg_id, self.__rcv_msg_size = id, size
-            if size > 0:
-                return True # more data to read, come back later
-        
-        # --- receive content -------------------------------------------------
-
-        if self.__rcv_buff_data.rest > 0:
             
-            ok = self.__recv_buff(self.__rcv_buff_data)
-            if not ok:
+            end = start + hlen + size
+            if end > self.__rcv_len:
+                break # more data to read, come back later
+            
+            # no copy, valid until the next data gets received
+            self.__handle_msg(id, self.__rcv_view[start + hlen:end])
+            
+            if self.__sock is None: # disconnected while handling message
                 return False
-            if self.__rcv_buff_data.rest > 0:
-                return True # more data to read, come back later
-        
-        # --- message complete ------------------------------------------------
             
-        msg_id = self.__rcv_msg_id
-        msg_data = self.__rcv_buff_data.data
-
-        log.debug("incoming msg ")
+            start = end
+        
+        if start > 0: # move incomplete message to the buffer's beginning
+            rest = self.__rcv_len - start
+            buff[:rest] = buff[start:self.__rcv_len]
+            self.__rcv_len = rest
+        
+        return True
+    
+    def __handle_msg(self, msg_id, msg_data):
+        """ Handle a received message. """
+        
+        # logger arguments: formatted only if debug logging is on (hot path)
+        log.debug("incoming msg: %d, %dB", msg_id, len(msg_data))
         
         if msg_id == message.IGNORE:
             
@@ -252,7 +253,6 @@ class ClientConnection(object):
             
             self.__msg_handler_fn(self, msg_id, msg_data)
         
-        return True
 
     def __io_error(self, fd, cond):
         """ GObject callback function (when there is an error). """
@@ -269,14 +269,32 @@ class ClientConnection(object):
     def __io_send(self, fd, cond):
         """ GObject callback function (when data can be written). """
         
-        if not self.__snd_buff:
+        if not self.__snd_queue and self.__snd_queue_low:
+            self.__snd_queue.append(self.__snd_queue_low.popleft())
+        
+        if not self.__snd_queue:
             self.__sid_out = 0
             return False
-
-        log.debug("try to send %d bytes to %s" % (len(self.__snd_buff), self))
+        
+        queue = self.__snd_queue
+        
+        # join following messages into one send, up to a size limit
+        data = buffer(queue[0][1], self.__snd_offset) # no copying
+        if len(queue) > 1 and len(data) + len(queue[1][1]) <= \
+           ClientConnection.IO_SND_CHUNK_MAX_SIZE:
+            chunk = bytearray(data)
+            for i in xrange(1, len(queue)):
+                msg = queue[i][1]
+                if len(chunk) + len(msg) > \
+                   ClientConnection.IO_SND_CHUNK_MAX_SIZE:
+                    break
+                chunk += msg
+            data = chunk
+        
+        log.debug("try to send %d bytes to %s" % (len(data), self))
 
         try:
-            sent = self.__sock.send(self.__snd_buff)
+            sent = self.__sock.send(data)
         except socket.error, e:
             log.warning("failed to send data to %s (%s)" % (self, e))
             self.disconnect()
@@ -289,20 +307,40 @@ class ClientConnection(object):
             self.disconnect()
             return False
         
-        self.__snd_buff = self.__snd_buff[sent:]
+        self.__snd_queue_size -= sent
         
-        if not self.__snd_buff:
+        # remove completely sent messages
+        while sent > 0:
+            unsent = len(queue[0][1]) - self.__snd_offset
+            if sent < unsent:
+                self.__snd_offset += sent
+                break
+            queue.popleft()
+            self.__snd_offset = 0
+            sent -= unsent
+        
+        if not self.__snd_queue and not self.__snd_queue_low:
             self.__sid_out = 0
             return False
         else:
             return True
     
-    def send(self, msg):
+    def send(self, msg, low_priority=False):
         """Send a message to the client.
         
+        Messages get queued until the client's socket is ready for writing.
+        A sync message (state, progress, item) replaces a queued but not yet
+        sent sync message of the same type, i.e. slow clients get only the
+        most recent sync data. 
+        
         @param msg:
             complete message (incl. ID and length) in binary format
             (net.build_message() is your friend here)
+        @keyword low_priority:
+            if True, the message gets sent only when no other messages are
+            queued - additionally a queued low priority sync message gets
+            dropped when a regular sync message of the same type is sent
+            (useful for big but less important data, e.g. full size images)
         
         @see: net.build_message()
         
@@ -319,8 +357,37 @@ class ClientConnection(object):
         if self.__psave:
             log.debug("%s is in sleep mode, send nothing" % self)
             return
-
-        self.__snd_buff = "%s%s" % (self.__snd_buff, msg)
+        
+        if len(msg) >= ClientConnection.IO_HEADER_LEN:
+            id = struct.unpack_from("!h", msg)[0]
+        else:
+            id = message.IGNORE
+        
+        if low_priority:
+            queue = self.__snd_queue_low
+            first = 0
+        else:
+            queue = self.__snd_queue
+            # first message may be sent partially already, do not touch it
+            first = int(self.__snd_offset > 0)
+        
+        if id in ClientConnection.IO_SND_COALESCE:
+            if not low_priority:
+                self.__drop_low_priority(id)
+            for i in xrange(first, len(queue)):
+                if queue[i][0] == id:
+                    log.debug("replace queued msg %d for %s" % (id, self))
+                    self.__snd_queue_size += len(msg) - len(queue[i][1])
+                    queue[i] = (id, msg)
+                    return
+        
+        queue.append((id, msg))
+        self.__snd_queue_size += len(msg)
+        
+        if self.__snd_queue_size > ClientConnection.IO_SND_QUEUE_MAX_SIZE:
+            log.warning("%s does not receive data fast enough" % self)
+            self.disconnect()
+            return
         
         # if not already trying to send data ..
         if self.__sid_out == 0:
@@ -328,6 +395,17 @@ class ClientConnection(object):
             self.__sid_out = gobject.io_add_watch(self.__sock, gobject.IO_OUT,
                                                   self.__io_send)
         
+    def __drop_low_priority(self, id):
+        """Drop queued low priority messages with the given ID."""
+        
+        queue = self.__snd_queue_low
+        
+        for i in xrange(len(queue) - 1, -1, -1):
+            if queue[i][0] == id:
+                log.debug("drop queued msg %d for %s" % (id, self))
+                self.__snd_queue_size -= len(queue[i][1])
+                del queue[i]
+        
     def disconnect(self, remove_from_list=True, send_bye_msg=False):
         """ Disconnect the client.
         
@@ -374,6 +452,11 @@ class ClientConnection(object):
             gobject.source_remove(self.__sid_out)
             self.__sid_out = 0
         
+        self.__snd_queue.clear()
+        self.__snd_queue_low.clear()
+        self.__snd_queue_size = 0
+        self.__snd_offset = 0
+        
         if self.__sock is not None:
             try:
                 self.__sock.shutdown(socket.SHUT_RDWR)
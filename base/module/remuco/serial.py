@@ -22,7 +22,6 @@
 
 import inspect
 import struct
-import array
 
 from remuco import log
 
@@ -45,16 +44,38 @@ class Bin:
     NET_ENCODING_ALT = ("UTF-8", "UTF8", "utf-8", "utf8") # synonyms
     HOST_ENCODING = NET_ENCODING # will be updated with value from config file
     
-    def __init__(self, buff=None):
+    def __init__(self, buff=None, size=0, reserve=0):
+        """ Create a new binary data container.
+        
+        @keyword buff: data to read from (if not set, the new Bin is used for
+            writing)
+        @keyword size: initial size of the write buffer (the buffer grows if
+            more data gets written, but ideally this is the exact size of all
+            data to write)
+        @keyword reserve: number of bytes to leave untouched at the beginning
+            of the write buffer (e.g. for a message header)
+        """
         
-        self.__data = buff or array.array('c')
-        self.__off = 0
+        if buff is None:
+            self.__data = bytearray(max(size, reserve))
+            self.__off = reserve
+        else:
+            self.__data = buff
+            self.__off = 0
         
     def get_buff(self):
+        """ Get the data (in case of a write buffer, all data written so far).
+        
+        Write buffers are returned as they are (i.e. as a bytearray, without
+        copying the data).
+        """
+        
         if isinstance(self.__data, basestring):
             return self.__data
-        elif isinstance(self.__data, array.array):
-            return self.__data.tostring()
+        elif isinstance(self.__data, bytearray):
+            if len(self.__data) > self.__off:
+                del self.__data[self.__off:]
+            return self.__data
         else:
             log.error("** BUG ** unexpected buffer type")
         
@@ -124,23 +145,23 @@ class Bin:
         
     def read_array_boolean(self):
         
-        return self.__read_array(self.read_boolean)
+        return [y != 0 for y in self.__read_array_packed('b')]
 
     def read_array_byte(self):
         
-        return self.__read_array(self.read_byte)
+        return self.__read_array_packed('b')
 
     def read_array_short(self):
         
-        return self.__read_array(self.read_short)
+        return self.__read_array_packed('h')
     
     def read_array_int(self):
         
-        return self.__read_array(self.read_int)
+        return self.__read_array_packed('i')
     
     def read_array_long(self):
         
-        return self.__read_array(self.read_long)
+        return self.__read_array_packed('q')
     
     def read_array_string(self):
         
@@ -154,6 +175,22 @@ class Bin:
         self.__off += l
         return s
         
+    def __read_array_packed(self, code):
+        """ Read an array of fixed size numbers in one go.
+        
+        @param code: struct code of the array's element type
+        """
+        
+        num = self.read_int()
+        
+        if num <= 0:
+            return []
+        
+        fmt = '!%d%s' % (num, code)
+        a = list(struct.unpack_from(fmt, self.__data, offset=self.__off))
+        self.__off += struct.calcsize(fmt)
+        return a
+        
     def __read_array(self, fn_read_element):
         
         num = self.read_int()
@@ -166,10 +203,24 @@ class Bin:
             
         return a
     
+    def read_struct(self, st):
+        """Read several values at once using a struct.Struct."""
+        
+        values = st.unpack_from(self.__data, self.__off)
+        self.__off += st.size
+        return values
+    
     def get_unused_data(self):
         
         return len(self.__data) - self.__off
         
+    def write_struct(self, st, values):
+        """Write several values at once using a struct.Struct."""
+        
+        self.__grow(st.size)
+        st.pack_into(self.__data, self.__off, *values)
+        self.__off += st.size
+        
     def write_type(self, type):
         
         self.write_byte(type)
@@ -184,28 +235,28 @@ class Bin:
     def write_byte(self, y):
         
         if y is None: y = 0
-        self.__data.extend(' ' * 1)
+        self.__grow(1)
         struct.pack_into('b', self.__data, self.__off, y)
         self.__off += 1
 
     def write_short(self, n):
         
         if n is None: n = 0
-        self.__data.extend(' ' * 2)
+        self.__grow(2)
         struct.pack_into('!h', self.__data, self.__off, n)
         self.__off += 2
 
     def write_int(self, i):
         
         if i is None: i = 0
-        self.__data.extend(' ' * 4)
+        self.__grow(4)
         struct.pack_into('!i', self.__data, self.__off, i)
         self.__off += 4
 
     def write_long(self, l):
         
         if l is None: l = 0
-        self.__data.extend(' ' * 8)
+        self.__grow(8)
         struct.pack_into('!q', self.__data, self.__off, l)
         self.__off += 8
 
@@ -217,60 +268,79 @@ class Bin:
         converted from Bin.HOST_ENCODING to Bin.NET_ENCODING.
         
         """
-        if s is None:
-            self.__write_string(s)
-            return
-        
-        if isinstance(s, unicode):
-            
-            try:
-                s = s.encode(Bin.NET_ENCODING)
-            except UnicodeEncodeError, e:
-                log.warning("could not encode '%s' with codec %s (%s)" %
-                            (s, Bin.NET_ENCODING, e))
-                s = str(s)
+        self.__write_string(_net_string(s))
+
+    def write_string_raw(self, s):
+        """ Write a string which already is encoded in Bin.NET_ENCODING. """
         
-        elif Bin.HOST_ENCODING not in Bin.NET_ENCODING_ALT:
-            log.debug("convert '%s' from %s to %s" %
-                      (s, Bin.HOST_ENCODING, Bin.NET_ENCODING))
-            try:
-                s = unicode(s, Bin.HOST_ENCODING).encode(Bin.NET_ENCODING)
-            except UnicodeDecodeError, e:
-                log.warning("could not decode '%s' with codec %s (%s)" %
-                            (s, Bin.HOST_ENCODING, e))
-            except UnicodeEncodeError, e:
-                log.warning("could not encode '%s' with codec %s (%s)" %
-                            (s, Bin.NET_ENCODING, e))
-            
         self.__write_string(s)
 
     def write_array_boolean(self, ba):
         
-        self.__write_array(ba, self.write_boolean)
+        self.__write_array_packed([b and 1 or 0 for b in ba or ()], 'b')
 
     def write_array_byte(self, ba):
         
         if isinstance(ba, str): # byte sequences often come as strings
             self.__write_string(ba, len_as_int=True)
         else:
-            self.__write_array(ba, self.write_byte)
+            self.__write_array_packed(ba, 'b')
 
     def write_array_short(self, na):
         
-        self.__write_array(na, self.write_short)
+        self.__write_array_packed(na, 'h')
 
     def write_array_int(self, ia):
         
-        self.__write_array(ia, self.write_int)
+        self.__write_array_packed(ia, 'i')
 
     def write_array_long(self, ia):
         
-        self.__write_array(ia, self.write_long)
+        self.__write_array_packed(ia, 'q')
 
     def write_array_string(self, sa):
         
-        self.__write_array(sa, self.write_string)
+        self.write_array_string_raw(_net_strings(sa))
+
+    def write_array_string_raw(self, sa):
+        """ Write strings which already are encoded in Bin.NET_ENCODING.
+        
+        All length prefixes get packed with one struct call and are joined
+        with the strings, so that the array gets written in one go.
+        """
+        
+        if not sa:
+            self.write_int(0)
+            return
+        
+        l = len(sa)
+        
+        heads = struct.pack('!%dh' % l, *[len(s) for s in sa])
+        
+        chunks = [None] * (2 * l)
+        chunks[0::2] = [heads[j:j + 2] for j in xrange(0, 2 * l, 2)]
+        chunks[1::2] = sa
+        chunks = ''.join(chunks)
+        
+        self.write_int(l)
+        
+        size = len(chunks)
+        self.__grow(size)
+        self.__data[self.__off:self.__off + size] = chunks
+        self.__off += size
 
+    def write_array_string_fragments(self, fa):
+        """ Write strings given as fragments from a StringCache. """
+        
+        chunks = ''.join(fa or ())
+        
+        self.write_int(len(fa or ()))
+        
+        size = len(chunks)
+        self.__grow(size)
+        self.__data[self.__off:self.__off + size] = chunks
+        self.__off += size
+        
     def __write_string(self, s, len_as_int=False):
         """ Write a string. 
         
@@ -290,25 +360,255 @@ class Bin:
         else:
             self.write_short(l)
         
-        self.__data.extend(' ' * l)
-        struct.pack_into('%ds' % l, self.__data, self.__off, s)
+        self.__grow(l)
+        self.__data[self.__off:self.__off + l] = s
         self.__off += l
         
-    def __write_array(self, a, fn_element_write):
+    def __write_array_packed(self, a, code):
+        """ Write an array of fixed size numbers in one go.
         
-        if a is None:
-            l = 0
-        else:
-            l = len(a)
+        Instead of writing element by element, the length and all elements
+        are packed with one struct call (elements which are None become 0).
         
-        self.write_int(l)
+        @param code: struct code of the array's element type
+        """
+        
+        if not a:
+            self.write_int(0)
+            return
+        
+        if None in a:
+            a = [e or 0 for e in a]
+        
+        l = len(a)
+        fmt = '!i%d%s' % (l, code)
+        size = struct.calcsize(fmt)
+        
+        self.__grow(size)
+        struct.pack_into(fmt, self.__data, self.__off, l, *a)
+        self.__off += size
+        
+    def __grow(self, size):
+        """ Ensure the write buffer has room for 'size' more bytes.
+        
+        Normally the buffer has been preallocated with the right size. If not,
+        it grows by at least its current size to keep reallocations rare.
+        """
         
-        for i in range(l):
+        missing = self.__off + size - len(self.__data)
+        
+        if missing > 0:
+            self.__data.extend('\0' * max(missing, len(self.__data)))
+
+def _net_string(s):
+    """ Convert a string to a plain string in Bin.NET_ENCODING.
+    
+    If the string is a unicode string, it will be encoded in Bin.NET_ENCODING.
+    If it already is a normal string it will be converted from
+    Bin.HOST_ENCODING to Bin.NET_ENCODING. None becomes an empty string.
+    
+    """
+    if s is None:
+        return ""
+    
+    if isinstance(s, unicode):
+        
+        try:
+            s = s.encode(Bin.NET_ENCODING)
+        except UnicodeEncodeError, e:
+            log.warning("could not encode '%s' with codec %s (%s)" %
+                        (s, Bin.NET_ENCODING, e))
+            s = str(s)
+    
+    elif not isinstance(s, str):
+        
+        s = str(s)
+    
+    elif Bin.HOST_ENCODING not in Bin.NET_ENCODING_ALT:
+        log.debug("convert '%s' from %s to %s" %
+                  (s, Bin.HOST_ENCODING, Bin.NET_ENCODING))
+        try:
+            s = unicode(s, Bin.HOST_ENCODING).encode(Bin.NET_ENCODING)
+        except UnicodeDecodeError, e:
+            log.warning("could not decode '%s' with codec %s (%s)" %
+                        (s, Bin.HOST_ENCODING, e))
+        except UnicodeEncodeError, e:
+            log.warning("could not encode '%s' with codec %s (%s)" %
+                        (s, Bin.NET_ENCODING, e))
+    
+    return s
+
+def _net_strings(sa):
+    """ Batch version of _net_string().
+    
+    Instead of converting each string on its own, strings which need a
+    conversion are joined, converted at once and split again. If that fails
+    (e.g. because of malformed strings), conversion falls back to
+    _net_string() for each string.
+    
+    """
+    if not sa:
+        return []
+    
+    sa = [isinstance(s, basestring) and s or _net_string(s) for s in sa]
+    
+    idx_uni = [i for i, s in enumerate(sa) if isinstance(s, unicode)]
+    
+    if Bin.HOST_ENCODING not in Bin.NET_ENCODING_ALT:
+        idx_str = [i for i, s in enumerate(sa) if not isinstance(s, unicode)]
+    else:
+        idx_str = []
+    
+    if idx_uni:
+        
+        batch = [sa[i] for i in idx_uni]
+        try:
+            conv = u'\0'.join(batch).encode(Bin.NET_ENCODING).split('\0')
+        except UnicodeEncodeError:
+            conv = ()
+        if len(conv) != len(batch): # a string contains a \0 or encoding failed
+            conv = [_net_string(s) for s in batch]
+        for i, s in zip(idx_uni, conv):
+            sa[i] = s
+    
+    if idx_str:
+        
+        batch = [sa[i] for i in idx_str]
+        try:
+            if u'\0'.encode(Bin.HOST_ENCODING) != '\0':
+                raise ValueError # splitting would not work
+            conv = unicode('\0'.join(batch), Bin.HOST_ENCODING)
+            conv = conv.encode(Bin.NET_ENCODING).split('\0')
+        except (ValueError, LookupError): # includes unicode errors
+            conv = ()
+        if len(conv) != len(batch):
+            conv = [_net_string(s) for s in batch]
+        for i, s in zip(idx_str, conv):
+            sa[i] = s
+    
+    return sa
+
+class StringCache(object):
+    """LRU cache for strings in their serialized form.
+    
+    A cached fragment is a string encoded in Bin.NET_ENCODING, prefixed by its
+    length - exactly as it is written into an array of strings. The cache is
+    bounded by the total size of all fragments. If Bin.HOST_ENCODING changes,
+    the cache gets cleared.
+    
+    """
+    def __init__(self, max_size=4194304):
+        """Create a new string cache.
+        
+        @keyword max_size: maximum size of all cached fragments in bytes
+        """
+        
+        self.max_size = max_size
+        
+        self.hits = 0
+        self.misses = 0
+        
+        self.clear()
+        
+    def __str__(self):
+        
+        return "(%d strings, %d bytes, %d hits, %d misses)" % (
+                len(self.__map), self.__size, self.hits, self.misses)
+        
+    def clear(self):
+        """Remove all cached fragments."""
+        
+        # circular doubly linked list of [prev, next, key, fragment], the
+        # root's next link is the least recently used one
+        self.__root = []
+        self.__root[:] = [self.__root, self.__root, None, None]
+        
+        self.__map = {} # maps strings to links
+        self.__size = 0
+        self.__encoding = Bin.HOST_ENCODING
+    
+    def get_fragments(self, sa):
+        """Get the fragments for a list of strings.
+        
+        Strings not yet cached get converted in one batch and added to the
+        cache.
+        
+        @param sa: list of strings
+        
+        @return: list of fragments (one for each string in 'sa')
+        """
+        
+        if not sa:
+            return []
+        
+        if self.__encoding != Bin.HOST_ENCODING:
+            self.clear()
             
-            fn_element_write(a[i])
+        root = self.__root
+        map_get = self.__map.get
+        
+        fragments = [None] * len(sa)
+        missing = []
+        
+        for j, s in enumerate(sa):
+            link = map_get(s)
+            if link is None:
+                missing.append(j)
+                continue
+            # move link to the most recently used end
+            link_prev, link_next = link[0], link[1]
+            link_prev[1] = link_next
+            link_next[0] = link_prev
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            fragments[j] = link[3]
+            
+        self.hits += len(sa) - len(missing)
+        self.misses += len(missing)
+        
+        if not missing:
+            return fragments
+        
+        strings = _net_strings([sa[j] for j in missing])
+        heads = struct.pack('!%dh' % len(strings), *[len(s) for s in strings])
+        
+        for k, j in enumerate(missing):
+            fragment = heads[2 * k:2 * k + 2] + strings[k]
+            fragments[j] = fragment
+            self.__add(sa[j], fragment)
+            
+        return fragments
+    
+    def __add(self, key, fragment):
+        
+        if key in self.__map:
+            return
+        
+        root = self.__root
+        last = root[0]
+        link = [last, root, key, fragment]
+        last[1] = root[0] = link
+        self.__map[key] = link
+        self.__size += len(fragment)
+        
+        while self.__size > self.max_size:
+            oldest = root[1]
+            root[1] = oldest[1]
+            oldest[1][0] = root
+            del self.__map[oldest[2]]
+            self.__size -= len(oldest[3])
+
+string_cache = StringCache()
 
 class Serializable(object):
 
+    # Indices (within get_fmt()) of TYPE_AS fields whose strings recur often
+    # (e.g. item IDs and names in item lists). These strings get serialized
+    # using the string cache.
+    CACHED_FIELDS = ()
+    
     def get_fmt(self):
         
         raise NotImplementedError
@@ -321,87 +621,260 @@ class Serializable(object):
 
         raise NotImplementedError
     
-def pack(serializable):
+def _prep_string(s):
+    
+    s = _net_string(s)
+    return s, 3 + len(s)
 
-    fmt = serializable.get_fmt()
+def _prep_array_string(sa):
     
-    data = serializable.get_data()
+    sa = _net_strings(sa)
+    return sa, 5 + 2 * len(sa) + sum([len(s) for s in sa])
+
+def _prep_array_string_cached(sa):
     
-    if len(fmt) != len(data):
-        log.error("** BUG ** format string and data differ in length")
-        return None
-        
-    #log.debug("data to pack: %s" % str(data))
+    fa = string_cache.get_fragments(sa)
+    return fa, 5 + sum([len(f) for f in fa])
 
-    bin = Bin()
+def _prep_array(element_size):
     
-    try:
+    def prep(a):
+        if a is None:
+            return a, 5
+        return a, 5 + element_size * len(a)
+    
+    return prep
 
-        for i in range(0,len(fmt)):
-            
-            type = fmt[i]
-            
-            bin.write_byte(type)
+class _Codec(object):
+    """Encoder/decoder compiled from a Serializable's format.
+    
+    Consecutive fixed size fields (including their type bytes) are merged
+    into one struct.Struct, so they get packed and unpacked with a single
+    call. Variable size fields (strings and arrays) are handled by Bin.
+    
+    Packing works in two passes: first strings get encoded and the exact size
+    of the binary data gets computed, then all data is written into one
+    preallocated buffer.
+    
+    Codecs are created by _get_codec() and cached per Serializable class.
+    """
+    
+    # struct codes and value normalizers for fixed size types
+    
+    SCALARS = {
+        TYPE_Y: ('b', lambda v: v or 0),
+        TYPE_B: ('b', lambda v: v and 1 or 0),
+        TYPE_N: ('h', lambda v: v or 0),
+        TYPE_I: ('i', lambda v: v or 0),
+        TYPE_L: ('q', lambda v: v or 0),
+    }
+    
+    # functions to prepare variable size values for writing and to compute
+    # their binary size (incl. type byte)
+    
+    PREPARERS = {
+        TYPE_S: _prep_string,
+        TYPE_AB: _prep_array(1),
+        TYPE_AY: _prep_array(1), # works for strings and lists
+        TYPE_AN: _prep_array(2),
+        TYPE_AI: _prep_array(4),
+        TYPE_AL: _prep_array(8),
+        TYPE_AS: _prep_array_string,
+    }
+    
+    # Bin methods for (prepared) variable size types
+    
+    WRITERS = {
+        TYPE_S: Bin.write_string_raw,
+        TYPE_AB: Bin.write_array_boolean,
+        TYPE_AY: Bin.write_array_byte,
+        TYPE_AN: Bin.write_array_short,
+        TYPE_AI: Bin.write_array_int,
+        TYPE_AL: Bin.write_array_long,
+        TYPE_AS: Bin.write_array_string_raw,
+    }
+    
+    READERS = {
+        TYPE_S: Bin.read_string,
+        TYPE_AB: Bin.read_array_boolean,
+        TYPE_AY: Bin.read_array_byte,
+        TYPE_AN: Bin.read_array_short,
+        TYPE_AI: Bin.read_array_int,
+        TYPE_AL: Bin.read_array_long,
+        TYPE_AS: Bin.read_array_string,
+    }
+    
+    def __init__(self, fmt, cached=()):
+        """Compile a format.
+        
+        @param fmt: format (tuple of TYPE_... constants) to compile
+        @keyword cached: indices of TYPE_AS fields to serialize using the
+            string cache
+        
+        @raise ValueError: if the format contains an unknown type
+        """
+        
+        self.fmt = fmt
+        self.__steps = [] # (struct, slots) or (None, (i, type, write, read))
+        self.__fixed_size = 0 # size of all scalar fields (incl. type bytes)
+        self.__variable = [] # (i, prepare) of all variable size fields
+        
+        run = [] # current run of scalar fields as (type, field index)
+        
+        for i, type in enumerate(fmt):
+            if type in _Codec.SCALARS:
+                run.append((type, i))
+            elif type in _Codec.WRITERS:
+                self.__add_run(run)
+                run = []
+                if type == TYPE_AS and i in cached:
+                    fn_prep = _prep_array_string_cached
+                    fn_write = Bin.write_array_string_fragments
+                else:
+                    fn_prep = _Codec.PREPARERS[type]
+                    fn_write = _Codec.WRITERS[type]
+                self.__steps.append((None, (i, type, fn_write,
+                                            _Codec.READERS[type])))
+                self.__variable.append((i, fn_prep))
+            else:
+                raise ValueError("unknown type (%d) in format string" % type)
             
-            if type == TYPE_Y:
-                
-                bin.write_byte(data[i])
-                
-            elif type == TYPE_B:
-                
-                bin.write_boolean(data[i])
+        self.__add_run(run)
         
-            elif type == TYPE_N:
-                
-                bin.write_short(data[i])
-                
-            elif type == TYPE_I:
-                
-                bin.write_int(data[i])
-                
-            elif type == TYPE_L:
-                
-                bin.write_long(data[i])
-                
-            elif type == TYPE_S:
-                
-                bin.write_string(data[i])
-                
-            elif type == TYPE_AB:
-                
-                bin.write_array_boolean(data[i])
-                
-            elif type == TYPE_AY:
-                
-                bin.write_array_byte(data[i])
-                
-            elif type == TYPE_AN:
-                
-                bin.write_array_short(data[i])
-
-            elif type == TYPE_AI:
+    def __add_run(self, run):
+        """Merge a run of scalar fields into one struct step."""
+        
+        if not run:
+            return
+        
+        codes = ''.join(['b%s' % _Codec.SCALARS[type][0] for type, i in run])
+        slots = [(type, i, _Codec.SCALARS[type][1]) for type, i in run]
+        
+        st = struct.Struct('!%s' % codes)
+        
+        self.__steps.append((st, slots))
+        self.__fixed_size += st.size
+        
+    def pack(self, data, reserve=0):
+        """Pack 'data' (matching this codec's format).
+        
+        @keyword reserve: number of bytes to reserve at the beginning of the
+            returned buffer
+        
+        @return: the binary data as a bytearray
+        """
+        
+        # first pass: prepare variable size data and compute size
+        
+        size = reserve + self.__fixed_size
+        prepared = {}
+        
+        for i, fn_prep in self.__variable:
+            prepared[i], var_size = fn_prep(data[i])
+            size += var_size
+        
+        # second pass: write into a preallocated buffer
+        
+        bin = Bin(size=size, reserve=reserve)
+        
+        for st, slots in self.__steps:
+            if st is not None:
+                values = []
+                for type, i, norm in slots:
+                    values.append(type)
+                    values.append(norm(data[i]))
+                bin.write_struct(st, values)
+            else:
+                i, type, fn_write, fn_read = slots
+                bin.write_byte(type)
+                fn_write(bin, prepared[i])
                 
-                bin.write_array_int(data[i])
-
-            elif type == TYPE_AL:
+        return bin.get_buff()
+    
+    def unpack(self, bin):
+        """Read data matching this codec's format from 'bin'.
+        
+        @return: the data as a list or None if the data is malformed
+        """
+        
+        data = []
+        
+        for st, slots in self.__steps:
+            if st is not None:
+                values = bin.read_struct(st)
+                for j, (type, i, norm) in enumerate(slots):
+                    if values[2 * j] != type:
+                        log.warning("bin data malformed (expected type %d, "
+                                    "have %d)" % (type, values[2 * j]))
+                        return None
+                    if type == TYPE_B:
+                        data.append(values[2 * j + 1] != 0)
+                    else:
+                        data.append(values[2 * j + 1])
+            else:
+                i, type, fn_write, fn_read = slots
+                if not bin.read_type(type):
+                    return None
+                data.append(fn_read(bin))
                 
-                bin.write_array_long(data[i])
+        return data
+    
+_codecs = {} # maps Serializable classes to codecs
 
-            elif type == TYPE_AS:
-                
-                bin.write_array_string(data[i])
+def _get_codec(serializable):
+    """Get the (cached) codec for a Serializable.
+    
+    @return: the codec or None if the serializable's format is broken
+    """
+    
+    fmt = serializable.get_fmt()
+    
+    cls = serializable.__class__
+    codec = _codecs.get(cls)
+    
+    if codec is None or codec.fmt != fmt:
+        try:
+            codec = _Codec(fmt, cached=serializable.CACHED_FIELDS)
+        except ValueError, e:
+            log.error("** BUG ** %s" % e)
+            return None
+        _codecs[cls] = codec
+        
+    return codec
+    
+def pack(serializable, reserve=0):
+    """ Serialize a Serializable.
+    
+    @param serializable:
+        the Serializable to serialize
+    
+    @keyword reserve:
+        number of bytes to leave free at the beginning of the returned buffer
+        (used to put a message header and the serialized data into the same
+        buffer)
+    
+    @return: the binary data as a bytearray or None if an error occurred
+    """
 
-            else:
-                log.error("** BUG ** unknown type (%d) in format string" % type)
-                return None
+    codec = _get_codec(serializable)
+    if codec is None:
+        return None
+    
+    data = serializable.get_data()
+    
+    if len(codec.fmt) != len(data):
+        log.error("** BUG ** format string and data differ in length")
+        return None
         
+    #log.debug("data to pack: %s" % str(data))
+
+    try:
+        return codec.pack(data, reserve=reserve)
     except struct.error, e:
         
         log.exception("** BUG ** %s" % e)
         
         return None
-    
-    return bin.get_buff()
 
 def unpack(serializable, bytes):
     """ Deserialize a Serializable.
@@ -420,82 +893,27 @@ def unpack(serializable, bytes):
     if inspect.isclass(serializable):
         serializable = serializable()
     
-    fmt = serializable.get_fmt()
+    codec = _get_codec(serializable)
+    if codec is None:
+        return None
     
-    if fmt and not bytes:
+    if codec.fmt and not bytes:
         log.warning("there is no data to unpack")
         return None
     
-    data = []
-    
     bin = Bin(buff=bytes)
     
     try:
-
-        for type in fmt:
-            
-            if not bin.read_type(type):
-                return None
-            
-            if type == TYPE_Y:
-                
-                data.append(bin.read_byte())
-                
-            elif type == TYPE_B:
-                
-                data.append(bin.read_boolean())
-        
-            elif type == TYPE_N:
-                
-                data.append(bin.read_short())
-                
-            elif type == TYPE_I:
-                
-                data.append(bin.read_int())
-                
-            elif type == TYPE_L:
-                
-                data.append(bin.read_long())
-                
-            elif type == TYPE_S:
-                
-                data.append(bin.read_string())
-                
-            elif type == TYPE_AB:
-                
-                data.append(bin.read_array_boolean())
-                
-            elif type == TYPE_AY:
-                
-                data.append(bin.read_array_byte())
-                
-            elif type == TYPE_AN:
-                
-                data.append(bin.read_array_short())
-
-            elif type == TYPE_AI:
-                
-                data.append(bin.read_array_int())
-
-            elif type == TYPE_AL:
-                
-                data.append(bin.read_array_long())
-
-            elif type == TYPE_AS:
-                
-                data.append(bin.read_array_string())
-
-            else:
-                
-                log.warning("bin data malformed (unknown data type: %d)" % type)
-                return None
-        
+        data = codec.unpack(bin)
     except struct.error, e:
         
         log.warning("bin data malformed (%s)" % e)
         
         return None
     
+    if data is None:
+        return None
+    
     unused = bin.get_unused_data()
     if unused:
         log.warning("there are %d unused bytes" % unused)
@@ -506,5 +924,3 @@ def unpack(serializable, bytes):
     #log.debug("unpacked data  : %s" % str(data))
 
     return serializable
-
-
@@ -0,0 +1,333 @@
+# =============================================================================
+#
+#    Remuco - A remote control system for media players.
+#    Copyright (C) 2006-2010 by the Remuco team, see AUTHORS.
+#
+#    This file is part of Remuco.
+#
+#    Remuco is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Remuco is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Remuco.  If not, see <http://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+"""Scaling and caching of images sent to clients."""
+
+from cStringIO import StringIO
+import hashlib
+import os
+import os.path
+import threading
+import urllib
+import urlparse
+
+try:
+    from collections import OrderedDict
+except ImportError: # Python < 2.7
+    OrderedDict = None
+
+import Image
+
+from remuco import log
+
+MEM_MAX_SIZE = 4194304 # bytes of thumbnails kept in memory
+DISK_MAX_SIZE = 33554432 # bytes of thumbnails kept on disk
+DISK_PRUNE_RATIO = 0.75 # prune disk cache to this fraction of its limit
+DISK_SUBDIR = "thumbs"
+
+def thumbnail(img, img_size, img_type):
+    """Scale an image.
+
+    @param img:
+        path to an image file or a PIL image object
+    @param img_size:
+        maximum width and height of the thumbnail
+    @param img_type:
+        image format of the thumbnail (e.g. 'JPEG' or 'PNG')
+
+    @return:
+        the thumbnail's image data (string) or an empty list if img is not
+        set, img_size is 0 or scaling failed
+
+    """
+    if img_size == 0:
+        return []
+
+    img = img_path(img)
+
+    if not img:
+        return []
+
+    try:
+        if isinstance(img, Image.Image):
+            img = img.copy() # do not shrink the caller's image
+        else:
+            img = Image.open(img)
+        img.thumbnail((img_size, img_size))
+        buf = StringIO()
+        img.save(buf, img_type)
+        return buf.getvalue()
+    except IOError, e:
+        log.warning("failed to thumbnail %s (%s)" % (img, e))
+        return []
+
+def img_path(img):
+    """Convert a file URI to a path, leave anything else as it is."""
+
+    if isinstance(img, basestring) and img.startswith("file://"):
+        img = urlparse.urlparse(img)[2]
+        img = urllib.url2pathname(img)
+
+    return img
+
+class ThumbnailCache(object):
+    """Thumbnail cache, in memory and optionally on disk.
+
+    Thumbnails are keyed by the image file's path, modification time and size
+    as well as by the requested thumbnail size and type. This way a changed
+    image file never results in a stale thumbnail. Images given as PIL image
+    objects are not cached.
+
+    The memory tier is a LRU cache limited by the size of the thumbnails
+    it contains. The disk tier is pruned on start up and whenever writing a
+    thumbnail makes it exceed its maximum size (then it gets pruned somewhat
+    below the maximum, so that not every following write triggers pruning).
+    Disk cache hits update a file's modification time, which is used to find
+    the least recently used thumbnails (access times are not reliable, e.g.
+    on file systems mounted with 'noatime' or 'relatime').
+
+    """
+    def __init__(self, cache_dir=None, mem_max=MEM_MAX_SIZE,
+                 disk_max=DISK_MAX_SIZE):
+        """Create a new thumbnail cache.
+
+        @keyword cache_dir:
+            base directory of the disk cache (if None, thumbnails are cached
+            in memory only)
+        @keyword mem_max:
+            maximum size in bytes of thumbnails in memory
+        @keyword disk_max:
+            maximum size in bytes of thumbnails on disk
+
+        """
+        if OrderedDict is not None:
+            self.__mem = OrderedDict()
+        else:
+            self.__mem = None # no LRU support, use the disk cache only
+        self.__mem_size = 0
+        self.__mem_max = mem_max
+        self.__lock = threading.Lock()
+
+        self.__disk_dir = None
+        self.__disk_size = 0
+        self.__disk_max = disk_max
+        self.__disk_lock = threading.Lock()
+        if cache_dir:
+            self.__disk_dir = os.path.join(cache_dir, DISK_SUBDIR)
+            try:
+                if not os.path.isdir(self.__disk_dir):
+                    os.makedirs(self.__disk_dir)
+                self.__prune_disk(disk_max)
+            except OSError, e:
+                log.warning("failed to set up thumbnail dir (%s)" % e)
+                self.__disk_dir = None
+
+    def get(self, img, img_size, img_type):
+        """Get a thumbnail.
+
+        Same as thumbnail() but returns a cached thumbnail if possible.
+
+        """
+        if img_size == 0:
+            return []
+
+        img = img_path(img)
+
+        if not img:
+            return []
+
+        if not isinstance(img, basestring):
+            return thumbnail(img, img_size, img_type)
+
+        try:
+            key = self.__key(img, img_size, img_type)
+        except OSError, e:
+            log.warning("failed to thumbnail %s (%s)" % (img, e))
+            return []
+
+        thumb = self.__mem_get(key)
+        if thumb is not None:
+            return thumb
+
+        thumb = self.__disk_get(key)
+        if thumb is None:
+            thumb = thumbnail(img, img_size, img_type)
+            if not thumb:
+                return thumb # do not cache failures (file may get fixed)
+            self.__disk_put(key, thumb)
+
+        self.__mem_put(key, thumb)
+
+        return thumb
+
+    def cached(self, img, img_size, img_type):
+        """Check if a thumbnail is cached, i.e. if get() is cheap."""
+
+        img = img_path(img)
+
+        if not img or not isinstance(img, basestring) or img_size == 0:
+            return False
+
+        try:
+            key = self.__key(img, img_size, img_type)
+        except OSError:
+            return False
+
+        if self.__mem_get(key) is not None:
+            return True
+
+        if self.__disk_dir is None:
+            return False
+
+        return os.path.exists(self.__disk_file(key))
+
+    def __key(self, img, img_size, img_type):
+
+        st = os.stat(img)
+
+        return (img, st.st_mtime, st.st_size, img_size, img_type)
+
+    def __mem_get(self, key):
+
+        if self.__mem is None:
+            return None
+
+        self.__lock.acquire()
+        try:
+            thumb = self.__mem.pop(key, None)
+            if thumb is not None:
+                self.__mem[key] = thumb # move to most recently used
+            return thumb
+        finally:
+            self.__lock.release()
+
+    def __mem_put(self, key, thumb):
+
+        if self.__mem is None or len(thumb) > self.__mem_max:
+            return
+
+        self.__lock.acquire()
+        try:
+            old = self.__mem.pop(key, None)
+            if old is not None:
+                self.__mem_size -= len(old)
+            self.__mem[key] = thumb
+            self.__mem_size += len(thumb)
+            while self.__mem_size > self.__mem_max:
+                dummy, old = self.__mem.popitem(last=False)
+                self.__mem_size -= len(old)
+        finally:
+            self.__lock.release()
+
+    def __disk_file(self, key):
+
+        return os.path.join(self.__disk_dir, hashlib.md5(repr(key)).hexdigest())
+
+    def __disk_get(self, key):
+
+        if self.__disk_dir is None:
+            return None
+
+        file = self.__disk_file(key)
+
+        try:
+            fp = open(file, "rb")
+        except IOError:
+            return None
+
+        try:
+            thumb = fp.read()
+        finally:
+            fp.close()
+
+        try:
+            os.utime(file, None) # mark as recently used
+        except OSError, e:
+            log.debug("failed to touch cached thumbnail (%s)" % e)
+
+        return thumb
+
+    def __disk_put(self, key, thumb):
+
+        if self.__disk_dir is None:
+            return
+
+        file = self.__disk_file(key)
+        file_tmp = "%s.%d.tmp" % (file, os.getpid())
+
+        try:
+            fp = open(file_tmp, "wb")
+            try:
+                fp.write(thumb)
+            finally:
+                fp.close()
+            os.rename(file_tmp, file)
+        except (IOError, OSError), e:
+            log.warning("failed to cache thumbnail (%s)" % e)
+            return
+
+        self.__disk_lock.acquire()
+        try:
+            self.__disk_size += len(thumb)
+            if self.__disk_size > self.__disk_max:
+                try:
+                    self.__prune_disk(int(self.__disk_max * DISK_PRUNE_RATIO))
+                except OSError, e:
+                    log.warning("failed to prune thumbnail dir (%s)" % e)
+        finally:
+            self.__disk_lock.release()
+
+    def __prune_disk(self, disk_max):
+        """Remove least recently used thumbnails exceeding the disk limit.
+
+        Also updates the current disk cache size.
+
+        """
+
+        files = []
+        size = 0
+        for name in os.listdir(self.__disk_dir):
+            file = os.path.join(self.__disk_dir, name)
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, file))
+            size += st.st_size
+
+        self.__disk_size = size
+
+        if size <= disk_max:
+            return
+
+        files.sort()
+        for mtime, fsize, file in files:
+            if size <= disk_max:
+                break
+            try:
+                os.remove(file)
+            except OSError, e:
+                log.warning("failed to remove cached thumbnail (%s)" % e)
+                continue
+            size -= fsize
+
+        self.__disk_size = size
@@ -24,10 +24,13 @@ import unittest
 
 import gobject
 
+import Queue
 import sys
 
 import remuco.log
-from remuco import PlayerAdapter
+from remuco import PlayerAdapter, Worker
+from remuco.adapter import _ListSnapshots
+from remuco.message import REQ_PLAYLIST, REQ_MLIB, REQ_SEARCH
 
 
 class AdapterTest(unittest.TestCase):
@@ -59,6 +62,60 @@ class AdapterTest(unittest.TestCase):
         
         self.__ml.run()
 
+    def test_list_snapshots(self):
+        
+        snapshots = _ListSnapshots(max_lists=2)
+        
+        snapshots.put("c1", REQ_PLAYLIST, None, "pl")
+        snapshots.put("c1", REQ_MLIB, ["a", "b"], "mlib-ab")
+        self.assertEquals(snapshots.get("c1", REQ_PLAYLIST, []), "pl")
+        self.assertEquals(snapshots.get("c1", REQ_MLIB, ("a", "b")), "mlib-ab")
+        self.assertEquals(snapshots.get("c1", REQ_MLIB, ["a"]), None)
+        
+        # snapshots are per client
+        self.assertEquals(snapshots.get("c2", REQ_PLAYLIST, []), None)
+        
+        # oldest snapshot gets dropped
+        snapshots.put("c1", REQ_SEARCH, ["x"], "search-x")
+        self.assertEquals(snapshots.get("c1", REQ_PLAYLIST, []), None)
+        
+        snapshots.invalidate([REQ_MLIB])
+        self.assertEquals(snapshots.get("c1", REQ_MLIB, ["a", "b"]), None)
+        self.assertEquals(snapshots.get("c1", REQ_SEARCH, ["x"]), "search-x")
+        
+        snapshots.invalidate()
+        self.assertEquals(snapshots.get("c1", REQ_SEARCH, ["x"]), None)
+        
+        # snapshots expire
+        snapshots = _ListSnapshots(ttl=-1)
+        snapshots.put("c1", REQ_PLAYLIST, None, "pl")
+        self.assertEquals(snapshots.get("c1", REQ_PLAYLIST, None), None)
+        
+    def test_worker(self):
+        
+        jobs = Queue.Queue()
+        results = []
+        
+        worker = Worker(jobs, current=lambda: 2)
+        worker.start()
+        
+        def deliver(result):
+            results.append(result)
+            if len(results) == 3:
+                self.__ml.quit()
+        
+        jobs.put((lambda x: x * 2, (1,), deliver, 2))
+        jobs.put((lambda x: x * 3, (1,), deliver, 1)) # outdated
+        jobs.put((lambda x: x / 0, (1,), deliver, None)) # fails
+        jobs.put((lambda x: x * 4, (1,), deliver, None))
+        jobs.put(None)
+        
+        gobject.timeout_add(2000, self.__ml.quit)
+        
+        self.__ml.run()
+        
+        self.assertEquals(results, [2, None, 4])
+        
     def __stop(self):
         
         self.__pa.stop()
@@ -31,7 +31,10 @@ from testdictool import DicToolTest
 from testserial import SerializationTest
 from testnet import ServerTest
 from testfiles import FilesTest
+from testart import ArtTest
+from testthumbs import ThumbsTest
 from testadapter import AdapterTest
+from testmpris import MPRISTest
 
 if __name__ == "__main__":
     
@@ -0,0 +1,134 @@
+# =============================================================================
+#
+#    Remuco - A remote control system for media players.
+#    Copyright (C) 2006-2010 by the Remuco team, see AUTHORS.
+#
+#    This file is part of Remuco.
+#
+#    Remuco is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Remuco is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Remuco.  If not, see <http://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+import unittest
+
+from remuco import art
+
+
+class ArtTest(unittest.TestCase):
+
+
+    def setUp(self):
+        
+        self.__dir = tempfile.mkdtemp()
+        self.__mtime = 1000000000
+        self.__song = os.path.join(self.__dir, "song.ogg")
+        self.__touch("song.ogg")
+        self.__embedded_dir = art.EMBEDDED_DIR
+        art.EMBEDDED_DIR = os.path.join(self.__dir, "embedded")
+
+    def tearDown(self):
+        
+        art.EMBEDDED_DIR = self.__embedded_dir
+        shutil.rmtree(self.__dir)
+        
+    def __touch(self, name):
+        
+        file = os.path.join(self.__dir, name)
+        open(file, "w").close()
+        return file
+    
+    def __changed(self):
+        """Make sure the folder's mtime changes, even on coarse file systems."""
+        
+        self.__mtime += 1
+        os.utime(self.__dir, (self.__mtime, self.__mtime))
+
+    def test_folder(self):
+        
+        self.assertEqual(art.get_art(self.__song), None)
+        
+        # cached miss gets invalidated by new files
+        any = self.__touch("zzz.png")
+        self.__changed()
+        self.assertEqual(art.get_art(self.__song), any)
+        self.assertEqual(art.get_art("file://%s" % self.__song), any)
+        
+        # best matching name wins
+        noisy = self.__touch("the cover image.jpg")
+        self.__touch("other.txt")
+        os.mkdir(os.path.join(self.__dir, "front.jpg"))
+        self.__changed()
+        self.assertEqual(art.get_art(self.__song), noisy)
+        
+        typical = self.__touch("Front.JPG")
+        self.__changed()
+        self.assertEqual(art.get_art(self.__song), typical)
+        
+        # removed files get noticed
+        os.remove(typical)
+        self.__changed()
+        self.assertEqual(art.get_art(self.__song), noisy)
+        
+    def test_embedded(self):
+        
+        # ID3v2.3 tag with a non-front and a front cover
+        frames = ""
+        for data in ("\x00image/png\x00\x04back\x00BACK",
+                     "\x00image/jpeg\x00\x03front\x00FRONT"):
+            frames += "APIC" + struct.pack(">IH", len(data), 0) + data
+        size = "".join([chr((len(frames) >> s) & 0x7F) for s in (21, 14, 7, 0)])
+        mp3 = os.path.join(self.__dir, "song.mp3")
+        fp = open(mp3, "wb")
+        fp.write("ID3\x03\x00\x00" + size + frames + "\xff\xfb" * 100)
+        fp.close()
+        
+        # FLAC file with a front cover
+        pic = (struct.pack(">II", 3, 9) + "image/png" + struct.pack(">I", 0) +
+               "\x00" * 16 + struct.pack(">I", 4) + "FLAC")
+        flac = os.path.join(self.__dir, "song.flac")
+        fp = open(flac, "wb")
+        fp.write("fLaC" + struct.pack(">I", 34) + "\x00" * 34 +
+                 chr(0x86) + struct.pack(">I", len(pic))[1:] + pic)
+        fp.close()
+        
+        file = art.get_art(mp3)
+        self.assertEqual(open(file, "rb").read(), "FRONT")
+        self.assertEqual(art.get_art(mp3), file)
+        
+        file = art.get_art(flac)
+        self.assertEqual(open(file, "rb").read(), "FLAC")
+        
+        self.assertEqual(art.get_art(self.__song), None)
+        
+        # art in folder is preferred
+        cover = self.__touch("cover.jpg")
+        self.__changed()
+        self.assertEqual(art.get_art(mp3), cover)
+        self.assertNotEqual(art.get_art(mp3, prefer_thumbnail=True), cover)
+        
+    def test_not_local(self):
+        
+        self.assertEqual(art.get_art(None), None)
+        self.assertEqual(art.get_art("http://host/song.ogg"), None)
+        self.assertEqual(art.get_art("/no/such/dir/song.ogg"), None)
+        
+if __name__ == "__main__":
+    
+    unittest.main()
@@ -0,0 +1,126 @@
+# =============================================================================
+#
+#    Remuco - A remote control system for media players.
+#    Copyright (C) 2006-2010 by the Remuco team, see AUTHORS.
+#
+#    This file is part of Remuco.
+#
+#    Remuco is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Remuco is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Remuco.  If not, see <http://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+
+import unittest
+
+from remuco import mpris
+
+
+class _TrackList(object):
+    """Fake MPRIS tracklist interface.
+    
+    Replies and change signals get queued and are delivered by flush().
+    
+    """
+    def __init__(self, adapter, length):
+        
+        self.tracks = [{"location": "file:///%d.ogg" % i, "title": str(i)}
+                       for i in range(length)]
+        self.metadata_calls = 0
+        self.__adapter = adapter
+        self.__events = []
+        
+    def flush(self):
+        
+        while self.__events:
+            self.__events.pop(0)()
+        
+    def GetLength(self, reply_handler, error_handler):
+        
+        self.__events.append(lambda: reply_handler(len(self.tracks)))
+        
+    def GetMetadata(self, position, reply_handler, error_handler):
+        
+        self.metadata_calls += 1
+        track = dict(self.tracks[position])
+        self.__events.append(lambda: reply_handler(track))
+        
+    def GetCurrentTrack(self, reply_handler, error_handler):
+        
+        self.__events.append(lambda: reply_handler(0))
+        
+    def DelTrack(self, position):
+        
+        del self.tracks[position]
+        self.__changed()
+        
+    def AddTrack(self, uri, play):
+        
+        self.tracks.append({"location": uri, "title": uri[8:-4]})
+        self.__changed()
+        
+    def __changed(self):
+        
+        length = len(self.tracks)
+        self.__events.append(
+            lambda: self.__adapter._notify_tracklist_change(length))
+
+class _Reply(object):
+    
+    def set_provider(self, length, get_page):
+        
+        self.ids = [id for id, name in get_page(0, length)]
+        
+    def send(self):
+        
+        pass
+
+class MPRISTest(unittest.TestCase):
+
+    def setUp(self):
+        
+        self.__pa = mpris.MPRISAdapter("unittest")
+        self.__pa._notify_caps(mpris.CAN_HAS_TRACKLIST)
+        self.__tl = _TrackList(self.__pa, 100)
+        self.__pa._mp_t = self.__tl
+        
+    def __playlist(self):
+        
+        reply = _Reply()
+        self.__pa.request_playlist(reply)
+        self.__tl.flush()
+        return reply.ids
+
+    def test_jump(self):
+        
+        locations = [t["location"] for t in self.__tl.tracks]
+        
+        self.assertEqual(self.__playlist(), locations)
+        self.assertEqual(self.__tl.metadata_calls, 100)
+        
+        self.__pa.action_playlist_item(mpris.IA_JUMP.id, [90], [])
+        self.__tl.flush()
+        
+        # the mirror already knows all tracks of the changed tracklist
+        self.assertEqual(self.__playlist(), locations)
+        self.assertEqual(self.__tl.metadata_calls, 100)
+        
+        # a change not done by the adapter gets fetched
+        self.__tl.AddTrack("file:///x.ogg", False)
+        self.__tl.flush()
+        self.assertEqual(self.__playlist(), locations + ["file:///x.ogg"])
+        self.assertEqual(self.__tl.metadata_calls, 102)
+        
+if __name__ == "__main__":
+    
+    unittest.main()
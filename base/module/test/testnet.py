@@ -20,12 +20,16 @@
 #
 # =============================================================================
 
+import socket
+import struct
 import unittest
 
 import gobject
 
-from remuco.data import PlayerInfo
+from remuco import message
+from remuco.data import PlayerInfo, Progress
 from remuco.net import WifiServer, BluetoothServer
+from remuco.net import ClientConnection, build_message
 from remuco.config import Config
 
 
@@ -53,6 +57,139 @@ class ServerTest(unittest.TestCase):
         
         self.__ml.run()
 
+    def test_send_queue(self):
+        
+        sock, peer = socket.socketpair()
+        
+        cc = ClientConnection(sock, "test", [], None, None, "test")
+        
+        for p in (1, 2, 3):
+            progress = Progress()
+            progress.progress = p
+            cc.send(build_message(message.SYNC_PROGRESS, progress))
+        
+        gobject.timeout_add(500, self.__ml.quit)
+        
+        self.__ml.run()
+        
+        data = peer.recv(1024)
+        
+        # hello message and only the most recent progress message
+        hlen = len(ClientConnection.IO_HELLO)
+        self.assertEquals(data[:hlen], ClientConnection.IO_HELLO)
+        id, size = struct.unpack("!hi", data[hlen:hlen + 6])
+        self.assertEquals(id, message.SYNC_PROGRESS)
+        self.assertEquals(len(data), hlen + 6 + size)
+        self.assertEquals(struct.unpack("!i", data[hlen + 7:hlen + 11])[0], 3)
+        
+        cc.disconnect()
+        peer.close()
+
+    def test_send_low_priority(self):
+        
+        sock, peer = socket.socketpair()
+        
+        cc = ClientConnection(sock, "test", [], None, None, "test")
+        
+        progress = Progress()
+        
+        # superseded by the next regular message of the same type
+        cc.send(build_message(message.SYNC_PROGRESS, progress),
+                low_priority=True)
+        # queued after regular messages
+        cc.send(build_message(message.SYNC_ITEM, None), low_priority=True)
+        cc.send(build_message(message.SYNC_PROGRESS, progress))
+        cc.send(build_message(message.SYNC_STATE, None))
+        
+        gobject.timeout_add(500, self.__ml.quit)
+        
+        self.__ml.run()
+        
+        data = peer.recv(1024)[len(ClientConnection.IO_HELLO):]
+        
+        ids = []
+        while data:
+            id, size = struct.unpack("!hi", data[:6])
+            ids.append(id)
+            data = data[6 + size:]
+            
+        self.assertEquals(ids, [message.SYNC_PROGRESS, message.SYNC_STATE,
+                                message.SYNC_ITEM])
+        
+        cc.disconnect()
+        peer.close()
+
+    def test_send_batched(self):
+        
+        sock, peer = socket.socketpair()
+        sock = socket.socket(_sock=sock) # allows to wrap send()
+        
+        sends = []
+        def send(data):
+            sends.append(len(data))
+            return sock_send(data)
+        sock_send = sock.send
+        sock.send = send
+        
+        cc = ClientConnection(sock, "test", [], None, None, "test")
+        
+        # many small messages go out in one send, big bursts in chunks
+        msgs = [ClientConnection.IO_HELLO]
+        for i in range(100):
+            size = (i % 10) * 1000
+            msgs.append(struct.pack("!hi", 1000 + i, size) + "x" * size)
+            cc.send(msgs[-1])
+        expected = "".join(msgs)
+        
+        received = []
+        def recv(fd, cond):
+            received.append(peer.recv(65536))
+            if len("".join(received)) < len(expected):
+                return True
+            self.__ml.quit()
+            return False
+        
+        gobject.io_add_watch(peer, gobject.IO_IN, recv)
+        gobject.timeout_add(2000, self.__ml.quit)
+        
+        self.__ml.run()
+        
+        self.assertEquals("".join(received), expected)
+        self.assertTrue(len(sends) < len(msgs) / 4)
+        self.assertTrue(max(sends) <= ClientConnection.IO_SND_CHUNK_MAX_SIZE)
+        
+        cc.disconnect()
+        peer.close()
+
+    def test_receive_pipelined(self):
+        
+        sock, peer = socket.socketpair()
+        
+        received = []
+        def handle(cc, id, data):
+            received.append((id, len(data)))
+        
+        cc = ClientConnection(sock, "test", [], None, handle, "test")
+        
+        max_size = ClientConnection.IO_MSG_MAX_SIZE
+        sizes = [0, 3, max_size, max_size - 1, 17] * 4
+        msgs = []
+        for id, size in enumerate(sizes):
+            msgs.append(struct.pack("!hi", 1000 + id, size))
+            msgs.append("x" * size)
+        
+        peer.sendall("".join(msgs))
+        
+        gobject.timeout_add(500, self.__ml.quit)
+        
+        self.__ml.run()
+        
+        self.assertEquals(received, [(1000 + id, size)
+                                     for id, size in enumerate(sizes)])
+        
+        cc.disconnect()
+        peer.close()
+
     def __stop(self, s):
         
         s.down()
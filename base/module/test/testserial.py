@@ -140,6 +140,15 @@ class _SerialzableClass(remuco.serial.Serializable):
             self.ba, self.ya1, self.ya2, self.na, self.ia1, self.ia2, self.la, \
             self.sa1, self.sa2 = data
 
+class _PlayerStateIn(data.PlayerState):
+    
+    def set_data(self, data):
+        self.data = data
+
+class _ItemListUncached(data.ItemList):
+    
+    CACHED_FIELDS = ()
+
 class SerializationTest(unittest.TestCase):
     
     def __serialize_and_dump(self, ser):
@@ -250,6 +259,102 @@ class SerializationTest(unittest.TestCase):
         sc3 = serial.unpack(_SerialzableClass(), None)
         self.assertTrue(sc3 is None)
         
+    def test_large_arrays(self):
+        
+        sc1 = _SerialzableClass()
+        sc1.init()
+        sc1.ba = [i % 3 == 0 for i in range(5000)]
+        sc1.ya2 = [i % 256 - 128 for i in range(5000)]
+        sc1.na = [None, -1] + range(-3000, 3000)
+        sc1.ia1 = range(-5000, 5000, 3)
+        sc1.la = [i << 33 for i in range(5000)]
+        
+        bindata = serial.pack(sc1)
+        self.assertFalse(bindata is None)
+        
+        sc2 = serial.unpack(_SerialzableClass, bindata)
+        self.assertFalse(sc2 is None)
+        
+        self.assertEquals(sc2.na[0], 0) # None becomes 0
+        sc2.na[0] = None
+        sc2.sa1[2] = None
+        sc2.ia2 = None
+        
+        self.assertEquals(sc1, sc2)
+        self.assertEquals(sc1.ya2, sc2.ya2)
+        self.assertEquals(sc1.ia1, sc2.ia1)
+        
+    def test_string_arrays(self):
+        
+        sc1 = _SerialzableClass()
+        sc1.init()
+        sc1.sa1 = ["n%d - ä" % i for i in range(10000)]
+        sc1.sa2 = [u"ü", "ö", u"with \0 inside", "", None, 7]
+        
+        sc2 = serial.unpack(_SerialzableClass, serial.pack(sc1))
+        self.assertFalse(sc2 is None)
+        
+        self.assertEquals(sc1.sa1, sc2.sa1)
+        self.assertEquals(sc2.sa2, ["ü", "ö", "with \0 inside", "", "", "7"])
+        
+    def test_string_cache(self):
+        
+        cache = serial.StringCache(max_size=30)
+        
+        fa = cache.get_fragments(["a", u"bä", None, "a"])
+        self.assertEquals(fa, ["\0\1a", "\0\3b\xc3\xa4", "\0\0", "\0\1a"])
+        self.assertEquals((cache.hits, cache.misses), (0, 4))
+        
+        cache.get_fragments(["a", "0123456789"])
+        self.assertEquals((cache.hits, cache.misses), (1, 5))
+        
+        # exceeds max size -> least recently used ones ("bä", None) get dropped
+        cache.get_fragments(["0123456789ab"])
+        cache.get_fragments(["a", "0123456789"])
+        self.assertEquals((cache.hits, cache.misses), (3, 6))
+        cache.get_fragments([u"bä", None])
+        self.assertEquals((cache.hits, cache.misses), (3, 8))
+        
+        # item lists use the cache for item IDs and names
+        names = ["%d - ä" % i for i in range(500)]
+        il1 = data.ItemList(1, ["p"], ["n"], names, names, 0, 0, 0, None, None)
+        bindata1 = serial.pack(il1)
+        hits = serial.string_cache.hits
+        bindata2 = serial.pack(il1)
+        self.assertEquals(bindata1, bindata2)
+        self.assertEquals(serial.string_cache.hits, hits + 1000)
+        
+        # .. which results in the same binary data as without using the cache
+        il2 = _ItemListUncached(1, ["p"], ["n"], names, names, 0, 0, 0, None,
+                                None)
+        self.assertEquals(serial.pack(il2), bindata1)
+        
+    def test_codec(self):
+        
+        ps1 = data.PlayerState()
+        ps1.volume = 50
+        ps1.shuffle = True
+        
+        bindata = serial.pack(ps1)
+        self.assertEquals(len(bindata), 6 + 1 + 1 + 4 + 1 + 1 + 1)
+        
+        # codec gets compiled once per class
+        codec = serial._get_codec(ps1)
+        self.assertTrue(serial._get_codec(data.PlayerState()) is codec)
+        self.assertEquals(serial.pack(ps1), bindata)
+        
+        # data gets written behind reserved bytes (e.g. for a message header)
+        self.assertEquals(serial.pack(ps1, reserve=6), "%s%s" % ("\0" * 6,
+                                                                 bindata))
+        
+        # a wrong type byte within a merged run of scalars gets detected
+        malformed = "%s%s%s" % (bindata[:2], chr(serial.TYPE_S), bindata[3:])
+        self.assertTrue(serial.unpack(_PlayerStateIn, malformed) is None)
+        
+        ps2 = serial.unpack(_PlayerStateIn, bindata)
+        self.assertFalse(ps2 is None)
+        self.assertEquals(ps2.data, [0, 50, 0, False, True, False])
+        
 if __name__ == '__main__':
     
     unittest.main()
@@ -0,0 +1,143 @@
+# =============================================================================
+#
+#    Remuco - A remote control system for media players.
+#    Copyright (C) 2006-2010 by the Remuco team, see AUTHORS.
+#
+#    This file is part of Remuco.
+#
+#    Remuco is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Remuco is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Remuco.  If not, see <http://www.gnu.org/licenses/>.
+#
+# =============================================================================
+
+
+from cStringIO import StringIO
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import Image
+
+from remuco import thumbs
+
+
+class ThumbsTest(unittest.TestCase):
+
+
+    def setUp(self):
+        
+        self.__dir = tempfile.mkdtemp()
+        self.__img = os.path.join(self.__dir, "cover.png")
+        Image.new("RGB", (200, 100), (255, 0, 0)).save(self.__img, "PNG")
+
+    def tearDown(self):
+        
+        shutil.rmtree(self.__dir)
+
+    def test_thumbnail(self):
+        
+        thumb = thumbs.thumbnail("file://%s" % self.__img, 50, "JPEG")
+        img = Image.open(StringIO(thumb))
+        self.assertEqual(img.format, "JPEG")
+        self.assertEqual(img.size, (50, 25))
+        
+        img = Image.open(self.__img)
+        thumbs.thumbnail(img, 50, "PNG")
+        self.assertEqual(img.size, (200, 100)) # not modified
+        
+    def test_cache(self):
+        
+        cache_dir = os.path.join(self.__dir, "cache")
+        
+        cache = thumbs.ThumbnailCache(cache_dir)
+        
+        self.assertFalse(cache.cached(self.__img, 50, "PNG"))
+        thumb = cache.get(self.__img, 50, "PNG")
+        self.assertTrue(thumb)
+        self.assertTrue(cache.cached(self.__img, 50, "PNG"))
+        self.assertEqual(thumb, thumbs.thumbnail(self.__img, 50, "PNG"))
+        
+        # memory hit
+        self.assertTrue(cache.get(self.__img, 50, "PNG") is thumb)
+        
+        # disk hit
+        cache = thumbs.ThumbnailCache(cache_dir)
+        self.assertTrue(cache.cached(self.__img, 50, "PNG"))
+        self.assertEqual(cache.get(self.__img, 50, "PNG"), thumb)
+        
+        # different parameters
+        self.assertNotEqual(cache.get(self.__img, 20, "PNG"), thumb)
+        self.assertNotEqual(cache.get(self.__img, 50, "JPEG"), thumb)
+        
+        # no image
+        self.assertEqual(cache.get(self.__img, 0, "PNG"), [])
+        self.assertEqual(cache.get(None, 50, "PNG"), [])
+        self.assertEqual(cache.get(self.__img + ".x", 50, "PNG"), [])
+        
+    def test_cache_memory_limit(self):
+        
+        cache = thumbs.ThumbnailCache(mem_max=1)
+        
+        thumb = cache.get(self.__img, 50, "PNG")
+        self.assertTrue(thumb)
+        self.assertFalse(cache.get(self.__img, 50, "PNG") is thumb)
+        
+    def test_cache_disk_limit(self):
+        
+        cache_dir = os.path.join(self.__dir, "cache")
+        thumb_dir = os.path.join(cache_dir, thumbs.DISK_SUBDIR)
+        
+        disk_max = len(thumbs.thumbnail(self.__img, 50, "PNG")) * 3
+        
+        cache = thumbs.ThumbnailCache(cache_dir, mem_max=0, disk_max=disk_max)
+        
+        for i in range(10):
+            img = os.path.join(self.__dir, "cover%d.png" % i)
+            shutil.copy(self.__img, img)
+            self.assertTrue(cache.get(img, 50, "PNG"))
+            size = 0
+            for name in os.listdir(thumb_dir):
+                size += os.path.getsize(os.path.join(thumb_dir, name))
+            self.assertTrue(size <= disk_max)
+        
+    def test_cache_disk_lru(self):
+        
+        cache_dir = os.path.join(self.__dir, "cache")
+        thumb_dir = os.path.join(cache_dir, thumbs.DISK_SUBDIR)
+        
+        img_a = os.path.join(self.__dir, "a.png")
+        img_b = os.path.join(self.__dir, "b.png")
+        shutil.copy(self.__img, img_a)
+        shutil.copy(self.__img, img_b)
+        
+        cache = thumbs.ThumbnailCache(cache_dir, mem_max=0)
+        cache.get(img_a, 50, "PNG")
+        cache.get(img_b, 50, "PNG")
+        
+        for name in os.listdir(thumb_dir):
+            os.utime(os.path.join(thumb_dir, name), (1000, 1000))
+        
+        # disk hit marks thumbnail of 'a' as recently used
+        cache.get(img_a, 50, "PNG")
+        
+        disk_max = len(thumbs.thumbnail(self.__img, 50, "PNG"))
+        cache = thumbs.ThumbnailCache(cache_dir, mem_max=0, disk_max=disk_max)
+        
+        self.assertTrue(cache.cached(img_a, 50, "PNG"))
+        self.assertFalse(cache.cached(img_b, 50, "PNG"))
+        
+if __name__ == "__main__":
+    
+    unittest.main()